@@ -0,0 +1,380 @@
+import numpy as np
+import pandas as pd
+import os
+import os.path
+import sys
+import time
+import shutil
+import tempfile
+import datetime as dt
+
+import covid
+
+##
+# parâmetros
+# ##
+
+# escalas (número de municípios, número de dias) usadas por padrão em rodar()
+escalas = [ (500, 60), (2000, 120), (5570, 200) ]
+
+# repetições de cada medida (o relatório traz a mediana e o mínimo)
+repeticoes = 3
+
+# seleção do gráfico medida em norm_grafico e construir_figura (Brasil, os dois primeiros estados e
+# os primeiros municípios gerados)
+n_estados_grafico = 2
+n_municipios_grafico = 5
+
+# fração dos municípios com texto de população "sujo", como o que o Ministério da Saúde passou a publicar
+# (ver covid_brasil.__preproc_covid)
+fracao_suja = 0.05
+
+# primeiro dia das séries sintéticas
+data_inicial = '2020-02-25'
+
+# regiões (pelo primeiro dígito de coduf) e siglas dos estados
+regioes = { 1: 'Norte', 2: 'Nordeste', 3: 'Sudeste', 4: 'Sul', 5: 'Centro-Oeste' }
+siglas = {
+    11: 'RO', 12: 'AC', 13: 'AM', 14: 'RR', 15: 'PA', 16: 'AP', 17: 'TO',
+    21: 'MA', 22: 'PI', 23: 'CE', 24: 'RN', 25: 'PB', 26: 'PE', 27: 'AL', 28: 'SE', 29: 'BA',
+    31: 'MG', 32: 'ES', 33: 'RJ', 35: 'SP',
+    41: 'PR', 42: 'SC', 43: 'RS',
+    50: 'MS', 51: 'MT', 52: 'GO', 53: 'DF'
+}
+
+colunas_hist_painel = [
+    'regiao', 'estado', 'municipio', 'coduf', 'codmun', 'codRegiaoSaude', 'nomeRegiaoSaude', 'data', 'semanaEpi',
+    'populacaoTCU2019', 'casosAcumulado', 'casosNovos', 'obitosAcumulado', 'obitosNovos',
+    'Recuperadosnovos', 'emAcompanhamentoNovos'
+]
+
+def formatar_populacao(populacao, rng, fracao_suja=fracao_suja):
+    """
+    texto da população como na planilha HIST_PAINEL_COVIDBR: milhares separados por ponto e, em parte dos
+    locais, sufixos espúrios ('(*)', '(**)', ' (1)', '*') ou o campo vazio
+    :param populacao: vetor de populações (inteiros)
+    :param rng: gerador de números aleatórios do numpy
+    :param fracao_suja: fração dos valores com sujeira
+    :return: lista de textos (None = campo vazio)
+    """
+    sufixos = [ '(*)', '(**)', ' (1)', '*' ]
+
+    textos = [ '{:,d}'.format(int(p)).replace(',', '.') for p in populacao ]
+    sujos = np.flatnonzero(rng.random(len(textos)) < fracao_suja)
+
+    for i in sujos:
+        # um em cada cinco valores sujos some da planilha
+        textos[i] = None if rng.random() < 0.2 else textos[i] + sufixos[rng.integers(len(sufixos))]
+
+    return textos
+
+def curvas(n_locais, n_dias, rng, taxa):
+    """
+    séries diárias sintéticas de casos e óbitos novos: uma curva logística por local, com início e
+    inclinação aleatórios, mais ruído de Poisson
+    :param n_locais: número de locais (linhas)
+    :param n_dias: número de dias (colunas)
+    :param rng: gerador de números aleatórios do numpy
+    :param taxa: vetor com o tamanho final de cada epidemia (casos acumulados esperados no último dia)
+    :return: (casos novos, óbitos novos), matrizes n_locais x n_dias de inteiros
+    """
+    dias = np.arange(n_dias)
+    inicio = rng.uniform(0.1, 0.7, n_locais)[:, None] * n_dias
+    inclinacao = rng.uniform(0.05, 0.2, n_locais)[:, None]
+
+    acumulado = taxa[:, None] / (1. + np.exp(-inclinacao * (dias[None, :] - inicio)))
+    esperado = np.diff(acumulado, axis=1, prepend=0.)
+
+    casos = rng.poisson(np.maximum(esperado, 0.))
+    obitos = rng.binomial(casos, rng.uniform(0.01, 0.05, n_locais)[:, None])
+
+    return casos, obitos
+
+def gerar_hist_painel(diretorio, n_locais=5570, n_dias=120, fracao_suja=fracao_suja, semente=0):
+    """
+    gera uma planilha HIST_PAINEL_COVIDBR sintética, com o mesmo esquema da publicada pelo Ministério da Saúde:
+        - uma linha por local e por dia: Brasil, estados, "sem município" de cada estado e municípios
+        - municípios reais (códigos e nomes de mun_demografia.csv), sorteados entre todos os ~5570
+        - casos e óbitos dos estados e do Brasil são as somas dos seus locais
+        - populações com a sujeira consertada em covid_brasil.__preproc_covid (ver formatar_populacao)
+    os arquivos demográficos do repositório são copiados para o mesmo diretório, de forma que
+    covid_brasil.ler_dados(diretorio) funciona (exceto a planilha de áreas; ver gerar_areas)
+
+    :param diretorio: o diretório raiz dos dados sintéticos (o arquivo vai para <diretorio>\\data\\Brasil)
+    :param n_locais: número de municípios (no máximo, todos os de mun_demografia.csv)
+    :param n_dias: número de dias
+    :param fracao_suja: fração dos locais com população "suja"
+    :param semente: semente do gerador de números aleatórios
+    :return: caminho do arquivo gerado
+    """
+    rng = np.random.default_rng(semente)
+
+    DATADIR_REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), r'..', r'data', r'Brasil')
+    DATADIR = os.path.join(diretorio, r'data', r'Brasil')
+    os.makedirs(DATADIR, exist_ok=True)
+
+    for arquivo in [ r'br_demografia.csv', r'mun_demografia.csv' ]:
+        shutil.copy(os.path.join(DATADIR_REPO, arquivo), os.path.join(DATADIR, arquivo))
+
+    # municípios reais, sorteados
+    nomes = pd.read_csv(os.path.join(DATADIR_REPO, r'mun_demografia.csv'), sep=';', usecols=['Município'])
+    nomes = nomes['Município'].str.split(' ', n=1, expand=True)
+    nomes.columns = [ 'codmun', 'municipio' ]
+    nomes['codmun'] = pd.to_numeric(nomes['codmun'], errors='coerce')     # a última linha é o total
+    nomes = nomes[(nomes['codmun'] // 10000).isin(siglas.keys())].astype({ 'codmun': int })
+
+    n_locais = min(n_locais, len(nomes))
+    mun = nomes.iloc[np.sort(rng.choice(len(nomes), n_locais, replace=False))].reset_index(drop=True)
+    mun['coduf'] = mun['codmun'] // 10000
+    ufs = np.unique(mun['coduf'])
+
+    pop_mun = np.round(rng.lognormal(9.5, 1.2, n_locais)).astype(int) + 800
+
+    # casos e óbitos diários: municípios e "sem município" de cada estado; estados e Brasil são somas
+    casos_mun, obitos_mun = curvas(n_locais, n_dias, rng, pop_mun * rng.uniform(0.005, 0.05, n_locais))
+    casos_sem, obitos_sem = curvas(len(ufs), n_dias, rng, rng.uniform(10, 500, len(ufs)))
+
+    pos_uf = np.searchsorted(ufs, mun['coduf'].to_numpy())
+    casos_uf = casos_sem + np.array([ casos_mun[pos_uf == i].sum(axis=0) for i in range(len(ufs)) ])
+    obitos_uf = obitos_sem + np.array([ obitos_mun[pos_uf == i].sum(axis=0) for i in range(len(ufs)) ])
+    pop_uf = np.bincount(pos_uf, weights=pop_mun, minlength=len(ufs)).astype(int)
+
+    # locais, na ordem da planilha: Brasil, estados, sem município, municípios
+    regiao_uf = [ regioes[uf // 10] for uf in ufs ]
+    sigla_uf = [ siglas[uf] for uf in ufs ]
+    regiao_saude = mun['coduf'] * 1000 + rng.integers(1, 20, n_locais)
+
+    locais = pd.concat([
+        pd.DataFrame({ 'regiao': ['Brasil'], 'coduf': [76],
+                       'populacaoTCU2019': formatar_populacao([pop_uf.sum()], rng, 0.) }),
+        pd.DataFrame({ 'regiao': regiao_uf, 'estado': sigla_uf, 'coduf': ufs,
+                       'populacaoTCU2019': formatar_populacao(pop_uf, rng, fracao_suja) }),
+        pd.DataFrame({ 'regiao': regiao_uf, 'estado': sigla_uf, 'coduf': ufs, 'codmun': ufs * 10000 }),
+        pd.DataFrame({ 'regiao': mun['coduf'].floordiv(10).map(regioes), 'estado': mun['coduf'].map(siglas),
+                       'municipio': mun['municipio'], 'coduf': mun['coduf'], 'codmun': mun['codmun'],
+                       'codRegiaoSaude': regiao_saude,
+                       'nomeRegiaoSaude': 'REGIAO ' + (regiao_saude % 1000).astype(str),
+                       'populacaoTCU2019': formatar_populacao(pop_mun, rng, fracao_suja) })
+    ], ignore_index=True, sort=False)
+
+    casos = np.vstack([ casos_uf.sum(axis=0, keepdims=True), casos_uf, casos_sem, casos_mun ])
+    obitos = np.vstack([ obitos_uf.sum(axis=0, keepdims=True), obitos_uf, obitos_sem, obitos_mun ])
+
+    # uma linha por local e dia
+    datas = pd.date_range(data_inicial, periods=n_dias)
+    semana = ((datas - pd.Timestamp('2019-12-29')).days // 7) % 53 + 1     # semana epidemiológica, aproximada
+
+    hist = locais.iloc[np.repeat(np.arange(len(locais)), n_dias)].reset_index(drop=True)
+    hist['data'] = np.tile(datas.strftime('%d/%m/%Y'), len(locais))
+    hist['semanaEpi'] = np.tile(semana, len(locais))
+    hist['casosNovos'] = casos.ravel()
+    hist['casosAcumulado'] = casos.cumsum(axis=1).ravel()
+    hist['obitosNovos'] = obitos.ravel()
+    hist['obitosAcumulado'] = obitos.cumsum(axis=1).ravel()
+
+    # recuperados e em acompanhamento: só nas linhas do Brasil
+    brasil = (hist['regiao'] == 'Brasil').to_numpy()
+    hist['Recuperadosnovos'] = pd.Series(np.where(brasil, hist['casosAcumulado'] * 0.6, np.nan)).round()
+    hist['emAcompanhamentoNovos'] = pd.Series(np.where(brasil, hist['casosAcumulado'] * 0.3, np.nan)).round()
+
+    colunas_inteiras = [ 'codmun', 'codRegiaoSaude', 'Recuperadosnovos', 'emAcompanhamentoNovos' ]
+    hist[colunas_inteiras] = hist[colunas_inteiras].astype('Int64')
+
+    DATAFILE = os.path.join(DATADIR, r'HIST_PAINEL_COVIDBR_sintetico_{}x{}.csv'.format(n_locais, n_dias))
+    hist[colunas_hist_painel].to_csv(DATAFILE, sep=';', index=False, encoding='windows-1252')
+
+    return DATAFILE
+
+def gerar_areas(arquivo, semente=0):
+    """
+    gera as duas abas da planilha de áreas do IBGE (AR_BR_MUN_2019 e AR_BR_UF_2019) para os locais de uma
+    planilha HIST_PAINEL_COVIDBR sintética, como as entrega pd.read_excel em covid_brasil.ler_dados
+    (a planilha em si não é escrita: o .xls exigiria mais uma dependência só para o benchmark)
+    :param arquivo: a planilha HIST_PAINEL_COVIDBR (ver gerar_hist_painel)
+    :param semente: semente do gerador de números aleatórios
+    :return: (áreas dos municípios, áreas dos estados)
+    """
+    rng = np.random.default_rng(semente)
+
+    mun = pd.read_csv(arquivo, sep=';', encoding='windows-1252',
+                      usecols=['estado', 'municipio', 'coduf', 'codmun'])
+    mun = mun[mun['municipio'].notnull()].drop_duplicates('codmun')
+    ufs = np.unique(mun['coduf'])
+
+    areas = pd.DataFrame({
+        'ID': np.arange(len(mun)),
+        'CD_GCUF': mun['coduf'].to_numpy(),
+        'NM_UF': mun['estado'].to_numpy(),
+        'NM_UF_SIGLA': mun['estado'].to_numpy(),
+        'CD_GCMUN': mun['codmun'].to_numpy() * 10 + rng.integers(0, 10, len(mun)),   # dígito verificador
+        'NM_MUN_2019': mun['municipio'].to_numpy(),
+        'AR_MUN_2019': rng.lognormal(6., 1., len(mun))
+    })
+
+    areas_estados = pd.DataFrame({
+        'ID': np.arange(len(ufs)),
+        'CD_GCUF': ufs,
+        'NM_UF': [ siglas[uf] for uf in ufs ],
+        'NM_UF_SIGLA': [ siglas[uf] for uf in ufs ],
+        'AR_MUN_2019': areas.groupby('CD_GCUF')['AR_MUN_2019'].sum().reindex(ufs).to_numpy() * 1.1
+    })
+
+    return areas, areas_estados
+
+def construir(diretorio, areas):
+    """
+    constrói covid_brasil a partir dos dados sintéticos, como em covid_brasil.__init__ (sem memoização nem
+    gráficos), com as áreas de gerar_areas no lugar da planilha do IBGE e com a instrumentação ligada
+    :param diretorio: o diretório raiz dos dados sintéticos
+    :param areas: (áreas dos municípios, áreas dos estados), ver gerar_areas
+    :return: instância de covid_brasil, com o relatório das etapas (ver covid_brasil.relatorio_desempenho)
+    """
+    br = covid.covid_brasil.__new__(covid.covid_brasil)
+    br.relatorio_etapas = []
+
+    instrumentar, covid.instrumentar = covid.instrumentar, True
+    try:
+        br.covidbr, _, _, br.demobr, br.demomun = br.ler_dados(
+            diretorio, fontes=['hist_painel', 'demografia_br', 'demografia_mun']
+        )
+        br.areas, br.areas_estados = areas[0].copy(), areas[1].copy()
+
+        br.preproc()
+        br.transform()
+    finally:
+        covid.instrumentar = instrumentar
+
+    return br
+
+def importar_dashapp():
+    """
+    importa webapp/dashapp.py sem carregar o snapshot nem montar o servidor (ver COVID_DASHAPP_SNAPSHOT)
+    :return: o módulo, ou None se as dependências do dashboard (dash, plotly) não estiverem instaladas
+    """
+    os.environ['COVID_DASHAPP_SNAPSHOT'] = '0'
+
+    WEBAPP = os.path.join(os.path.dirname(os.path.abspath(__file__)), r'webapp')
+    anterior = os.getcwd()
+    os.chdir(WEBAPP)
+    if WEBAPP not in sys.path:
+        sys.path.insert(0, WEBAPP)
+
+    try:
+        import dashapp
+    except ImportError:
+        dashapp = None
+    finally:
+        os.chdir(anterior)
+
+    return dashapp
+
+def cronometrar(funcao, repeticoes=repeticoes):
+    """
+    mede o tempo de relógio de uma função
+    :param funcao: função sem argumentos
+    :param repeticoes: número de execuções
+    :return: (lista de tempos em segundos, valor retornado pela última execução)
+    """
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append(time.perf_counter() - inicio)
+
+    return tempos, resultado
+
+def medidas_escala(n_locais, n_dias, repeticoes=repeticoes, dashapp=None, semente=0):
+    """
+    roda o benchmark em uma escala: gera os dados sintéticos e mede
+        - construcao: construção completa de covid_brasil
+        - cada etapa da construção (do relatório de instrumentação, ver covid_brasil.medir)
+        - norm_grafico e covid_plot.construir_figura (se dashapp for dado) na seleção padrão
+    :param n_locais: número de municípios
+    :param n_dias: número de dias
+    :param repeticoes: repetições de cada medida
+    :param dashapp: módulo webapp/dashapp.py (ver importar_dashapp). Se None, construir_figura não é medida
+    :param semente: semente dos dados sintéticos
+    :return: DataFrame com uma linha por medida e repetição
+    """
+    registros = []
+
+    def registrar(medida, tempos, linhas):
+        for i, tempo in enumerate(tempos):
+            registros.append(dict(medida=medida, repeticao=i, tempo=tempo, linhas=linhas))
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        arquivo = gerar_hist_painel(diretorio, n_locais=n_locais, n_dias=n_dias, semente=semente)
+        areas = gerar_areas(arquivo, semente=semente)
+
+        # construção: o relatório de cada repetição dá o tempo das etapas
+        etapas = []
+        for i in range(repeticoes):
+            tempos, br = cronometrar(lambda: construir(diretorio, areas), 1)
+            registrar('construcao', tempos, len(br.covidbr))
+            etapas.append(br.relatorio_desempenho().assign(repeticao=i))
+
+        etapas = pd.concat(etapas, ignore_index=True)
+        for medida, relatorio in etapas.groupby('etapa', sort=False):
+            for _, linha in relatorio.iterrows():
+                registros.append(dict(medida=medida, repeticao=linha['repeticao'], tempo=linha['tempo'],
+                                      linhas=linha['linhas']))
+
+    # seleção do gráfico: Brasil, alguns estados e municípios
+    locais = br.locais
+    estados = [ 76 ] + sorted(locais['coduf'].dropna().unique().tolist())[:n_estados_grafico]
+    municipios = locais.loc[locais['tipo_local'] == covid.tipos_local['municipio'], 'codmun']
+    municipios = municipios.head(n_municipios_grafico).tolist()
+
+    dados = br.series_rel(estados=estados, municipios=municipios)
+    tempos, _ = cronometrar(lambda: br.norm_grafico(dados=dados, normalizacao=['percapita'], norm_xy='y',
+                                                     crlf='<br>', plotly=True, chaves=['x_ott7', 'y_ott7']),
+                            repeticoes)
+    registrar('norm_grafico', tempos, len(dados))
+
+    if dashapp is not None:
+        plot = dashapp.covid_plot.__new__(dashapp.covid_plot)
+        plot.br = br
+        tempos, _ = cronometrar(lambda: plot.construir_figura(estados, municipios, ['percapita'],
+                                                              x='x_ott', y='y_ott'),
+                                repeticoes)
+        registrar('construir_figura', tempos, len(dados))
+
+    return pd.DataFrame(registros).assign(n_locais=n_locais, n_dias=n_dias)
+
+def rodar(escalas=escalas, repeticoes=repeticoes, arquivo=None, figura=True):
+    """
+    roda o benchmark em várias escalas
+    :param escalas: lista de (número de municípios, número de dias)
+    :param repeticoes: repetições de cada medida
+    :param arquivo: se dado, CSV em que as medidas brutas são acrescentadas (com a data da execução),
+        para acompanhar a evolução do desempenho
+    :param figura: se True, mede também covid_plot.construir_figura (exige dash e plotly)
+    :return: DataFrame com a mediana e o mínimo de cada medida, e a vazão (linhas por segundo, pela mediana)
+    """
+    dashapp = importar_dashapp() if figura else None
+    if figura and dashapp is None:
+        print('dash/plotly não instalados: construir_figura não será medida')
+
+    medidas = pd.concat([ medidas_escala(n_locais, n_dias, repeticoes, dashapp) for n_locais, n_dias in escalas ],
+                        ignore_index=True)
+
+    if arquivo is not None:
+        medidas.assign(execucao=dt.datetime.now().isoformat()).to_csv(
+            arquivo, mode='a', header=not os.path.exists(arquivo), index=False
+        )
+
+    resumo = medidas.groupby(['n_locais', 'n_dias', 'medida'], sort=False).agg(
+        linhas=('linhas', 'max'), mediana=('tempo', 'median'), minimo=('tempo', 'min')
+    )
+    resumo['linhas_s'] = resumo['linhas'] / resumo['mediana']
+
+    return resumo
+
+if __name__ == '__main__':
+    # uso: python benchmark.py [<municípios>x<dias> ...]
+    # ex.: python benchmark.py 500x60 5570x200
+    if len(sys.argv) > 1:
+        escalas = [ tuple(int(n) for n in escala.split('x')) for escala in sys.argv[1:] ]
+
+    with pd.option_context('display.width', 200, 'display.max_rows', None):
+        print(rodar(escalas=escalas, arquivo=r'benchmark.csv'))
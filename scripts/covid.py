@@ -6,14 +6,31 @@
 import numpy as np
 import pandas as pd
 import os.path
+import shutil
+import time
+import functools
+import threading
 import datetime as dt
 import locale
 import seaborn as sns
 import pickle as pkl
+import json
+import hashlib
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.csv as pacsv
 #import pymc3 as pm
 import matplotlib.pyplot as plt
 from matplotlib.ticker import LogFormatterSciNotation
 
+try:
+    import psutil       # memória residente do processo (opcional; no Linux, lida de /proc sem ele)
+except ImportError:
+    psutil = None
+
 sns.set(style = 'ticks', rc = { 'grid.color': '.8', 'grid.linestyle': '-'})
 locale.setlocale(locale.LC_ALL,'portuguese_brazil')
 
@@ -22,6 +39,206 @@ locale.setlocale(locale.LC_ALL,'portuguese_brazil')
 # ##
 mm_periodo = 5
 
+# janelas das médias móveis (0 = sem suavização)
+mm_janelas = [0, 3, 5, 7]
+
+# janela da soma de casos e óbitos na última semana
+janela_semana = 7
+
+# limiar de óbitos por MM hab. a partir do qual os dados entram em covidrel
+limiar_obito_MMhab = 0.1
+
+# política de tipos numéricos
+#   contagens (casos, óbitos, códigos, população): 'int64' ou 'int32'. Colunas sem nulos ficam como inteiros
+#   do numpy; colunas com nulos usam o inteiro mascarado do pandas de mesmo tamanho ('Int64' ou 'Int32')
+tipo_contagens = 'int64'
+colunas_contagens = ['coduf', 'codmun', 'codRegiaoSaude', 'semanaEpi', 'populacaoTCU2019',
+                     'casosAcumulado', 'casosNovos', 'obitosAcumulado', 'obitosNovos',
+                     'Recuperadosnovos', 'emAcompanhamentoNovos']
+
+#   referência nominal para a economia da política no relatório de memória (ver covid_brasil.relatorio_memoria):
+#   o inteiro mascarado com que as contagens ficariam sem a política. Não é o tipo lido de fato
+#   (o leitor pyarrow já entrega as contagens nos tipos da política), e vale para os dois leitores
+tipo_referencia_contagens = 'Int64'
+
+#   colunas derivadas (normalizações, incidência, letalidade, mortalidade, somas semanais e médias móveis):
+#   'float64' ou 'float32'. 'float32' ocupa metade da memória, ao custo de ~7 dígitos significativos
+tipo_derivadas = 'float64'
+
+# sugestões de tipos mais baratos (ver covid_brasil.relatorio_memoria):
+#   texto vira 'category' se tiver no máximo limiar_categoria valores distintos por linha
+#   real vira 'float32' se o erro relativo da conversão não passar de tolerancia_float32
+limiar_categoria = 0.5
+tolerancia_float32 = 1e-6
+
+# ##
+# grafo de etapas do pré-processamento e da normalização
+# ##
+# cada etapa (método covid_brasil.__<etapa>) declara as entradas que lê e as saídas que produz:
+# tabelas (ex.: 'areas') ou colunas de covidbr (ex.: 'covidbr.area').
+# entradas que nenhuma etapa produz são os dados brutos lidos por ler_dados.
+# etapas de uma mesma fase cujas entradas já estão prontas rodam simultaneamente, exceto as que escrevem na mesma
+# tabela (ver covid_brasil.executar_etapas). As da fase 'norm' escrevem todas em covidbr: rodam sempre em sequência
+# etapas com 'memo' têm as saídas memoizadas em disco (ver covid_brasil.rodar_etapa)
+etapas = {
+    'preproc_covid': {'fase': 'preproc', 'entradas': ['hist_painel'], 'saidas': ['covidbr']},
+    'preproc_areas': {'fase': 'preproc', 'entradas': ['areas_ibge'],
+                      'saidas': ['areas', 'areas_estados', 'area_brasil'], 'memo': True},
+    'preproc_demobr': {'fase': 'preproc', 'entradas': ['demografia_br'], 'saidas': ['demobr'], 'memo': True},
+    'preproc_demomun': {'fase': 'preproc', 'entradas': ['demografia_mun'],
+                        'saidas': ['demomun', 'demo_velhos', 'velhos_estados'], 'memo': True},
+    'enriquecer_areas': {'fase': 'preproc', 'entradas': ['covidbr', 'areas', 'areas_estados'],
+                         'saidas': ['covidbr.area']},
+    'enriquecer_velhos': {'fase': 'preproc', 'entradas': ['covidbr', 'demo_velhos', 'velhos_estados'],
+                          'saidas': ['covidbr.pct_velhos']},
+
+    'norm_casos_obitos_percapita': {'fase': 'norm', 'entradas': ['covidbr'],
+                                    'saidas': ['covidbr.norm_percapita']},
+    'norm_densidade_demografica': {'fase': 'norm', 'entradas': ['covidbr', 'covidbr.area'],
+                                   'saidas': ['covidbr.norm_densidade']},
+    'norm_perfil_demografico': {'fase': 'norm', 'entradas': ['covidbr.pct_velhos'],
+                                'saidas': ['covidbr.norm_demo']},
+}
+
+# memoização das etapas: pasta (relativa ao diretório raiz) e versão do código das etapas.
+# a chave de cada etapa combina a versão, o código-fonte do método da etapa e o conteúdo dos arquivos
+# de que ela depende (direta ou indiretamente): incrementar memo_versao invalida toda a memoização
+memo_dir = r'data\cache\etapas'
+memo_versao = 1
+
+# atributos preenchidos por cada fonte de dados brutos (ver covid_brasil.arquivos_fontes),
+# na ordem do retorno de covid_brasil.ler_dados
+atributos_fontes = {
+    'hist_painel': ['covidbr'],
+    'areas_ibge': ['areas', 'areas_estados'],
+    'demografia_br': ['demobr'],
+    'demografia_mun': ['demomun']
+}
+
+# tipos de local (coluna tipo_local, ver substituir_nomes)
+tipos_local = {'municipio': 0, 'sem_municipio': 1, 'resumo_estado': 2, 'brasil': 3}
+
+# tipos que correspondem a resumos (estaduais e do Brasil), excluídos pelas máscaras mask_exc_resumo*
+tipos_resumo = [tipos_local['resumo_estado'], tipos_local['brasil']]
+
+# colunas constantes em cada local: ficam uma única vez na tabela de dimensão 'locais',
+# e não em cada linha diária de covidbr e covidrel
+colunas_locais = ['regiao', 'estado', 'municipio', 'coduf', 'codmun', 'codRegiaoSaude', 'nomeRegiaoSaude',
+                  'populacaoTCU2019', 'area', 'pct_velhos', 'norm_percapita', 'norm_densidade', 'norm_demo',
+                  'tipo_local', 'local']
+
+# tabelas (DataFrames e Series) salvas individualmente no snapshot colunar
+snapshot_tabelas = ['covidbr', 'covidrel', 'locais', 'indice_rel', 'areas', 'areas_estados', 'area_brasil',
+                    'demobr', 'demomun', 'demo_velhos',
+                    'mask_forademunicipios', 'mask_obitoMMhab', 'mask_exc_resumo', 'mask_exc_resumo_rel']
+
+# atributos simples (listas, strings) salvos no manifesto do snapshot
+snapshot_atributos = ['interessante', 'agrupar_full', 'agrupar_estado', 'agrupar_regiao']
+
+snapshot_manifesto = r'manifesto.json'
+snapshot_versao = 3
+
+# cada snapshot fica em um subdiretório próprio da pasta do snapshot; o arquivo snapshot_ponteiro indica o atual.
+# os snapshot_manter mais recentes são mantidos, para os processos que ainda leem os anteriores
+snapshot_ponteiro = r'atual.txt'
+snapshot_manter = 3
+
+# instrumentação das etapas (ver covid_brasil.medir): o relatório fica em covid_brasil.relatorio_etapas.
+# desligada por padrão: mede-se sob demanda (ex.: benchmark.py)
+instrumentar = False
+
+# arquivo JSON (relativo ao diretório raiz) em que o relatório é salvo ao fim de cada construção. None: não salvar
+relatorio_json = None
+
+# intervalo (s) entre as amostras da memória residente durante as etapas medidas
+intervalo_amostragem = 0.01
+
+def rss_atual():
+    """
+    memória residente atual do processo
+    :return: bytes, ou None se não for possível medi-la (sem psutil, fora do Linux)
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class amostrador_memoria:
+    """
+    amostra a memória residente do processo em um thread, enquanto houver alguma medição ativa
+    (ver covid_brasil.medir), guardando o maior valor visto por cada medição.
+    medições simultâneas (etapas em paralelo, etapas aninhadas) veem a mesma memória do processo
+    """
+
+    def __init__(self, intervalo=intervalo_amostragem):
+        self.intervalo = intervalo
+        self.trava = threading.Lock()
+        self.picos = {}
+        self.parar = None
+
+    def iniciar(self, chave):
+        """
+        começa a acompanhar uma medição
+        :param chave: identificador da medição
+        :return: memória residente no início (bytes), ou None se não for possível medi-la
+        """
+        rss = rss_atual()
+        if rss is None:
+            return None
+
+        with self.trava:
+            self.picos[chave] = rss
+            if self.parar is None:
+                self.parar = threading.Event()
+                threading.Thread(target=self.amostrar, args=(self.parar,), daemon=True).start()
+
+        return rss
+
+    def terminar(self, chave):
+        """
+        encerra uma medição (o thread de amostragem para quando não houver nenhuma ativa)
+        :param chave: identificador da medição
+        :return: maior memória residente vista durante a medição (bytes)
+        """
+        rss = rss_atual()
+
+        with self.trava:
+            pico = max(self.picos.pop(chave), rss)
+            if len(self.picos) == 0:
+                self.parar.set()
+                self.parar = None
+
+        return pico
+
+    def amostrar(self, parar):
+        while not parar.wait(self.intervalo):
+            rss = rss_atual()
+            with self.trava:
+                for chave in self.picos:
+                    self.picos[chave] = max(self.picos[chave], rss)
+
+amostrador = amostrador_memoria()
+
+def instrumentada(*saidas):
+    """
+    decorador de métodos de covid_brasil: cada chamada é medida por covid_brasil.medir
+    :param saidas: saídas do método (tabelas ou colunas de covidbr), para a contagem de linhas e bytes.
+        Se nenhuma for dada, conta-se o valor retornado
+    :return: decorador
+    """
+    def decorador(metodo):
+        @functools.wraps(metodo)
+        def medido(self, *args, **kwargs):
+            with self.medir(metodo.__name__.lstrip('_'), saidas) as registro:
+                resultado = metodo(self, *args, **kwargs)
+                registro['resultado'] = resultado
+            return resultado
+        return medido
+    return decorador
 
 # classe para enganar o formatador com notação científica.
 class CustomTicker(LogFormatterSciNotation):
@@ -34,7 +251,7 @@ class covid_brasil:
     da COVID-19
     """
 
-    def __init__(self, diretorio=None, graficos=True, dumbcache=False):
+    def __init__(self, diretorio=None, graficos=True, dumbcache=False, memo=True):
 
         # se diretorio for None, corresponde ao diretorio raiz do script
 
@@ -46,13 +263,21 @@ class covid_brasil:
             self.dumbcache_load()
 
         else:
+            # só são lidos os arquivos cujas etapas não estão memoizadas
+            if memo:
+                self.ativar_memo(diretorio)
+
+            self.relatorio_etapas = []
+
             self.covidbr, self.areas, \
             self.areas_estados, self.demobr, \
-            self.demomun = self.ler_dados(diretorio)
+            self.demomun = self.ler_dados(diretorio, fontes=self.fontes_necessarias())
 
             self.preproc()
             self.transform()
 
+            self.salvar_relatorio(diretorio)
+
         if graficos:
             self.graficos()
 
@@ -68,61 +293,284 @@ class covid_brasil:
         with open(DUMBCACHE, 'wb') as f:
             pkl.dump(obj, f)
 
-    def ler_dados(self, diretorio):
+    def snapshot_dump(self, cache_dir=r'data\cache\snapshot'):
+        """
+        salva os dados em formato colunar (Arrow/Feather) em um subdiretório novo da pasta 'cache_dir'
+            - cada DataFrame (ou Series) em snapshot_tabelas vira um arquivo .feather não comprimido,
+              de forma que possa ser mapeado em memória na leitura
+            - um manifesto (manifesto.json) descreve os arquivos e guarda os atributos simples
+            - só depois de tudo escrito o ponteiro (snapshot_ponteiro) passa a indicar o subdiretório novo
+
+        nenhum arquivo de um snapshot é sobrescrito: um processo que carregou o snapshot anterior continua lendo
+        todas as tabelas do mesmo subdiretório, e um processo novo nunca mistura tabelas de dois snapshots
+        (no Windows, um arquivo mapeado por outro processo nem poderia ser substituído).
+        ao contrário do dumbcache_dump, não salva os objetos do matplotlib (self.eixos)
+        :param cache_dir: pasta do snapshot, relativa ao diretório raiz
+        :return: nome do subdiretório do snapshot
+        """
+        RAIZ_DIR = os.path.join(r'..', cache_dir)
+
+        criado_em = dt.datetime.now()
+        id_snapshot = criado_em.strftime('%Y%m%d-%H%M%S-%f')
+        SNAPSHOT_DIR = os.path.join(RAIZ_DIR, id_snapshot)
+        os.makedirs(SNAPSHOT_DIR)
+
+        manifesto = {
+            'versao': snapshot_versao,
+            'id': id_snapshot,
+            'criado_em': criado_em.isoformat(),
+            'tabelas': {},
+            'atributos': {}
+        }
+
+        for nome in snapshot_tabelas:
+            obj = self.__dict__.get(nome)
+            if obj is None:
+                continue
+
+            # Series são salvas como DataFrames de uma coluna
+            tipo = 'Series' if isinstance(obj, pd.Series) else 'DataFrame'
+            df = obj.to_frame(name=nome) if tipo == 'Series' else obj
+
+            arquivo = nome + '.feather'
+            tabela = pa.Table.from_pandas(df, preserve_index=True)
+            feather.write_feather(tabela, os.path.join(SNAPSHOT_DIR, arquivo), compression='uncompressed')
+
+            manifesto['tabelas'][nome] = {
+                'arquivo': arquivo,
+                'tipo': tipo,
+                'linhas': len(df),
+                'colunas': [ str(c) for c in df.columns ]
+            }
+            if tipo == 'Series':
+                manifesto['tabelas'][nome]['nome_serie'] = obj.name
+
+        for nome in snapshot_atributos:
+            if nome in self.__dict__:
+                manifesto['atributos'][nome] = self.__dict__[nome]
+
+        with open(os.path.join(SNAPSHOT_DIR, snapshot_manifesto), 'w', encoding='utf-8') as f:
+            json.dump(manifesto, f, ensure_ascii=False, indent=2)
+
+        # troca atômica do snapshot atual: o ponteiro é escrito em arquivo temporário e substituído
+        with open(os.path.join(RAIZ_DIR, snapshot_ponteiro + '.tmp'), 'w', encoding='utf-8') as f:
+            f.write(id_snapshot)
+        os.replace(os.path.join(RAIZ_DIR, snapshot_ponteiro + '.tmp'), os.path.join(RAIZ_DIR, snapshot_ponteiro))
+
+        # descartar os snapshots antigos (os que ainda estiverem mapeados por algum processo ficam para a próxima)
+        anteriores = sorted(d for d in os.listdir(RAIZ_DIR)
+                            if os.path.isfile(os.path.join(RAIZ_DIR, d, snapshot_manifesto)))
+        for d in anteriores[:-snapshot_manter]:
+            shutil.rmtree(os.path.join(RAIZ_DIR, d), ignore_errors=True)
+
+        return id_snapshot
+
+    def snapshot_tabela(self, nome, colunas=None):
         """
-        ler os dados
-            1) da planilha excel exposta diariamente por https://covid.saude.gov.br/
-            2) de dados geográficos (áreas de municípios e estados) brasileiros
+        lê uma tabela do snapshot colunar via mapeamento de memória
+        :param nome: nome da tabela (ex.: 'covidbr')
+        :param colunas: lista de colunas a serem lidas. Se None, lê todas
+        :return: DataFrame (ou Series, caso a tabela tenha sido salva como Series)
+        """
+        snapshot = self.__dict__.get('_snapshot')
+        if snapshot is None:
+            raise ValueError('instância não foi carregada de um snapshot (use snapshot_load)')
 
-        :param diretorio: o diretório contendo os arquivos excel
-        :return: dataframes contendo as informações dos arquivos excel
+        info = snapshot['tabelas'][nome]
+        tabela = feather.read_table(os.path.join(self._snapshot_dir, info['arquivo']),
+                                    columns=colunas, memory_map=True)
+
+        # split_blocks evita consolidar as colunas em um único bloco (e, portanto, copiá-las)
+        df = tabela.to_pandas(split_blocks=True)
+
+        if info['tipo'] == 'Series':
+            return df[nome].rename(info['nome_serie'])
+
+        return df
+
+    def snapshot_arrow(self, nome):
+        """
+        tabela do snapshot colunar como pyarrow.Table mapeada em memória, sem conversão para pandas.
+        os buffers apontam diretamente para o arquivo: as páginas são somente leitura e compartilhadas
+        (via cache de páginas do sistema operacional) por todos os processos que leem o mesmo snapshot
+        :param nome: nome da tabela (ex.: 'covidrel')
+        :return: pyarrow.Table
+        """
+        snapshot = self.__dict__.get('_snapshot')
+        if snapshot is None:
+            raise ValueError('instância não foi carregada de um snapshot (use snapshot_load)')
+
+        tabelas = self.__dict__.setdefault('_snapshot_arrow', {})
+        if nome not in tabelas:
+            tabelas[nome] = feather.read_table(os.path.join(self._snapshot_dir, snapshot['tabelas'][nome]['arquivo']),
+                                               memory_map=True)
+
+        return tabelas[nome]
+
+    def materializado(self, nome):
         """
+        informa se a tabela já está na memória do processo como DataFrame
+        (ou se, vinda de um snapshot, ainda pode ser lida sob demanda)
+        :param nome: nome da tabela
+        :return: bool
+        """
+        return nome in self.__dict__ or '_snapshot' not in self.__dict__
+
+    def colunas(self, nome, colunas):
+        """
+        algumas colunas de uma tabela, sem materializar a tabela inteira quando ela vem de um snapshot
+        (a ordem das linhas é a mesma da tabela)
+        :param nome: nome da tabela (ex.: 'covidrel')
+        :param colunas: lista de colunas
+        :return: DataFrame
+        """
+        if self.materializado(nome):
+            return getattr(self, nome)[colunas]
+
+        return self.snapshot_tabela(nome, colunas=colunas)
 
-        # dados da evolução da COVID-19
+    def __getattr__(self, nome):
+        """
+        carregamento preguiçoso das tabelas de um snapshot colunar:
+        só é chamado quando o atributo ainda não existe na instância
+        :param nome: nome do atributo
+        :return: a tabela correspondente, lida do snapshot
+        """
+        snapshot = self.__dict__.get('_snapshot')
+        if snapshot is None or nome not in snapshot['tabelas']:
+            raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, nome))
+
+        valor = self.snapshot_tabela(nome)
+        setattr(self, nome, valor)
+        return valor
+
+    def ler_hist_painel(self, diretorio, motor='pyarrow'):
+        """
+        ler a planilha HIST_PAINEL_COVIDBR com data de modificação mais recente
+        :param diretorio: o diretório contendo os arquivos
+        :param motor: 'pyarrow' (leitor multithread, que já entrega datas, contagens e nomes de locais nos tipos
+            finais) ou 'pandas' (leitor padrão do pandas, com as datas como texto, convertidas em __preproc_covid)
+        :return: dataframe com os dados brutos da planilha
+        """
         # abrir planilha com data de modificação mais recente
-        csv_files = [ os.path.join(diretorio, r'data', r'Brasil', f)
-                        for f in os.listdir(os.path.join(diretorio, r'data', r'Brasil'))
-                        if f.startswith('HIST_PAINEL_COVIDBR') and f.endswith('.csv') ]
-        csv_files.sort(key=lambda x:os.path.getmtime(x))
-        DATAFILE_DATA_io = csv_files[-1]
-        
-        cols_dtypes = { k: 'string' for k in [ 'regiao', 'estado', 'municipio', 'nomeRegiaoSaude' ] }
-        cols_dtypes.update({
-            k: 'Int64' for k in [ 'coduf', 'codmun', 'codRegiaoSaude', 'semanaEpi',
-                                  'casosAcumulado', 'casosNovos', 'obitosAcumulado', 'obitosNovos',
-                                  'Recuperadosnovos', 'emAcompanhamentoNovos' ]
-        })
+        DATAFILE_DATA_io = self.arquivos_fontes(diretorio)['hist_painel']
+
+        cols_string = [ 'regiao', 'estado', 'municipio', 'nomeRegiaoSaude' ]
+        cols_int = [ 'coduf', 'codmun', 'codRegiaoSaude', 'semanaEpi',
+                     'casosAcumulado', 'casosNovos', 'obitosAcumulado', 'obitosNovos',
+                     'Recuperadosnovos', 'emAcompanhamentoNovos' ]
+
+        if motor == 'pyarrow':
+            # a conversão de windows-1252 é feita em fluxo, e os tipos finais saem direto do leitor:
+            # nomes de locais como dicionários (categóricos no pandas), contagens como inteiros de tipo_contagens
+            # e datas como timestamp
+            # populacaoTCU2019 continua como texto, para ser consertada em __preproc_covid
+            tipo_int = pa.from_numpy_dtype(np.dtype(tipo_contagens))
+
+            tipos = { k: pa.dictionary(pa.int32(), pa.string()) for k in cols_string }
+            tipos['populacaoTCU2019'] = pa.string()
+            tipos.update({ k: tipo_int for k in cols_int })
+            tipos['data'] = pa.timestamp('ns')
+
+            tabela = pacsv.read_csv(
+                DATAFILE_DATA_io,
+                read_options=pacsv.ReadOptions(encoding='windows-1252', use_threads=True),
+                parse_options=pacsv.ParseOptions(delimiter=';'),
+                convert_options=pacsv.ConvertOptions(column_types=tipos, strings_can_be_null=True,
+                                                     timestamp_parsers=['%d/%m/%Y'])
+            )
+
+            # as datas são lidas como UTC e levadas ao fuso de Brasília, como faz DataFrame.astype no leitor pandas
+            tabela = tabela.set_column(tabela.column_names.index('data'), 'data',
+                                       tabela.column('data').cast(pa.timestamp('ns', tz='America/Sao_Paulo')))
+
+            # contagens com nulos como inteiros mascarados do pandas (ex.: Int64), as demais como inteiros do numpy
+            # (a mesma escolha de tipos_contagens)
+            mascaradas = [ k for k in cols_int if tabela.column(k).null_count > 0 ]
+            tipo_mascarado = pd.api.types.pandas_dtype(tipo_contagens.capitalize())
+
+            covid = tabela.drop(mascaradas).to_pandas()
+            if mascaradas:
+                covid = covid.join(pa.table({ k: tabela.column(k) for k in mascaradas }).
+                                   to_pandas(types_mapper={ tipo_int: tipo_mascarado }.get))
+
+            return covid[tabela.column_names]
+
+        cols_dtypes = { k: 'string' for k in cols_string }
+        cols_dtypes.update({ k: 'Int64' for k in cols_int })
         
         # mistaken dtypes for correction
         cols_dtypes.update({
             k: 'string' for k in [ 'populacaoTCU2019', 'data' ]
         })
-        cols_dtypes_dt = { k: 'datetime64[ns]' for k in ['data'] }
         covid = pd.read_csv(DATAFILE_DATA_io, sep=';',
             encoding='windows-1252', dtype=cols_dtypes
         )
 
-        # dados geográficos dos territórios brasileiros
-        DATAFILE_GEO = r'AR_BR_RG_UF_RGINT_RGIM_MES_MIC_MUN_2019.xls'
-        DATAFILE_GEO_io = os.path.join(diretorio, r'data', r'Brasil', DATAFILE_GEO)
+        return covid
+
+    def arquivos_fontes(self, diretorio):
+        """
+        arquivos de cada fonte de dados brutos (as entradas do grafo de etapas que nenhuma etapa produz)
+        :param diretorio: o diretório raiz dos dados
+        :return: dicionário { fonte: caminho do arquivo }
+        """
+        DATADIR = os.path.join(diretorio, r'data', r'Brasil')
+
+        # planilha HIST_PAINEL_COVIDBR com data de modificação mais recente
+        csv_files = [ os.path.join(DATADIR, f) for f in os.listdir(DATADIR)
+                        if f.startswith('HIST_PAINEL_COVIDBR') and f.endswith('.csv') ]
+        csv_files.sort(key=lambda x:os.path.getmtime(x))
 
-        areas_mun = pd.read_excel(DATAFILE_GEO_io, sheet_name='AR_BR_MUN_2019')
+        return {
+            'hist_painel': csv_files[-1],
 
-        areas_estados = pd.read_excel(DATAFILE_GEO_io, sheet_name='AR_BR_UF_2019')
+            # dados geográficos dos territórios brasileiros
+            'areas_ibge': os.path.join(DATADIR, r'AR_BR_RG_UF_RGINT_RGIM_MES_MIC_MUN_2019.xls'),
 
-        # dados demográficos agregados do Brasil por sexo
-        DATAFILE_DEMOBR = r'br_demografia.csv'
-        DATAFILE_DEMOBR_io = os.path.join(diretorio, r'data', r'Brasil', DATAFILE_DEMOBR)
+            # dados demográficos agregados do Brasil por sexo
+            'demografia_br': os.path.join(DATADIR, r'br_demografia.csv'),
 
-        demo_br = pd.read_csv(DATAFILE_DEMOBR_io, sep=';')
+            # dados demográficos agregados do Brasil por município
+            'demografia_mun': os.path.join(DATADIR, r'mun_demografia.csv')
+        }
+
+    @instrumentada()
+    def ler_dados(self, diretorio, paralelo=True, fontes=None):
+        """
+        ler os dados
+            1) da planilha excel exposta diariamente por https://covid.saude.gov.br/
+            2) de dados geográficos (áreas de municípios e estados) brasileiros
+            3) de dados demográficos brasileiros (agregados e por município)
 
-        # dados demográficos agregados do Brasil por município
-        DATAFILE_DEMOMUN = r'mun_demografia.csv'
-        DATAFILE_DEMOMUN_io = os.path.join(diretorio, r'data', r'Brasil', DATAFILE_DEMOMUN)
+        os arquivos são lidos simultaneamente (um thread por arquivo), de forma que o tempo total é o do
+        arquivo mais lento; a planilha de áreas é aberta uma única vez para as duas abas
 
-        demo_mun = pd.read_csv(DATAFILE_DEMOMUN_io, sep=';')
+        :param diretorio: o diretório contendo os arquivos excel
+        :param paralelo: se False, os arquivos são lidos um após o outro
+        :param fontes: fontes a serem lidas (ver arquivos_fontes). Se None, todas. As demais retornam None
+        :return: dataframes contendo as informações dos arquivos excel
+        """
+        arquivos = self.arquivos_fontes(diretorio)
+        if fontes is None:
+            fontes = arquivos.keys()
 
-        return covid, areas_mun, areas_estados, demo_br, demo_mun
+        leitores = {
+            # dados da evolução da COVID-19
+            'hist_painel': lambda: self.ler_hist_painel(diretorio),
+            'areas_ibge': lambda: pd.read_excel(arquivos['areas_ibge'], sheet_name=['AR_BR_MUN_2019', 'AR_BR_UF_2019']),
+            'demografia_br': lambda: pd.read_csv(arquivos['demografia_br'], sep=';'),
+            'demografia_mun': lambda: pd.read_csv(arquivos['demografia_mun'], sep=';')
+        }
+
+        with ThreadPoolExecutor(max_workers=4 if paralelo else 1) as executor:
+            futuros = { fonte: executor.submit(leitores[fonte]) for fonte in fontes }
+            dados = { fonte: futuro.result() for fonte, futuro in futuros.items() }
+
+        areas = dados.get('areas_ibge', {})
+
+        return dados.get('hist_painel'), areas.get('AR_BR_MUN_2019'), areas.get('AR_BR_UF_2019'), \
+               dados.get('demografia_br'), dados.get('demografia_mun')
 
     def __preproc_covid(self):
         """
@@ -130,37 +578,48 @@ class covid_brasil:
         :return: None
         """
 
-        # processar datas
-        
-        self.covidbr['data'] = pd.to_datetime(self.covidbr['data'], format='%d/%m/%Y')
-        self.covidbr['data'] = self.covidbr['data'].astype(pd.DatetimeTZDtype(tz='America/Sao_Paulo'))
+        # processar datas (o leitor pyarrow já as entrega no tipo final; o do pandas, como texto)
+
+        if not isinstance(self.covidbr['data'].dtype, pd.DatetimeTZDtype):
+            self.covidbr['data'] = pd.to_datetime(self.covidbr['data'], format='%d/%m/%Y')
+            self.covidbr['data'] = self.covidbr['data'].astype(pd.DatetimeTZDtype(tz='America/Sao_Paulo'))
 
         # 2020-06-02: O Ministério da Saúde cagou os dados de população na planilha divulgada diariamente.
         # devemos consertá-lo
         # regex: ^((?:\d{1,3}\.)*\d*)
 
-        # preencher populacao de areas dos estados que não estão em nenhum município
+        # a população é constante em cada local: o texto se repete em todas as datas.
+        # consertar uma vez por valor distinto (alguns milhares) e propagar às linhas pelos códigos
 
-        pop_estados = self.covidbr[(self.covidbr.estado.notnull()) & (self.covidbr.codmun.isnull())].\
-                        groupby('coduf').populacaoTCU2019.first()
-        df = self.covidbr.merge(right=pop_estados, on='coduf', how='left')
-        populacaoTCU2019 = df.populacaoTCU2019_x.where(df.populacaoTCU2019_x.notnull(), other=df.populacaoTCU2019_y)
+        codigos, valores = pd.factorize(self.covidbr['populacaoTCU2019'])
 
         # filtrar dados espúrios de população
+        valores = pd.Series(valores, dtype='string').str.extract(r'^((?:\d{1,3}\.)*\d*)', expand=False).\
+                  str.replace('.', '', regex=False)
+        valores = pd.to_numeric(valores, errors='coerce').to_numpy(dtype=float)
 
-        populacaoTCU2019 = populacaoTCU2019.str.extract(r'^((?:\d{1,3}\.)*\d*)', expand=False).\
-                           str.replace('.','').astype(float)
+        populacaoTCU2019 = np.append(valores, np.nan)[codigos]
+
+        # preencher populacao de areas dos estados que não estão em nenhum município
+
+        mask_estados = (self.covidbr.estado.notnull() & self.covidbr.codmun.isnull()).to_numpy(dtype=bool)
+        pop_estados = pd.Series(populacaoTCU2019[mask_estados]).\
+                        groupby(self.covidbr['coduf'].to_numpy(dtype=float, na_value=np.nan)[mask_estados]).first()
+
+        faltando = np.isnan(populacaoTCU2019)
+        populacaoTCU2019[faltando] = self.covidbr['coduf'][faltando].map(pop_estados).\
+                                     to_numpy(dtype=float, na_value=np.nan)
 
         # converter tipos
 
-        df['populacaoTCU2019'] = populacaoTCU2019
-        df.drop(columns=[ 'populacaoTCU2019_' + mergedir for mergedir in ['x', 'y'] ], inplace=True)
-        self.covidbr = df
+        self.covidbr = self.covidbr.drop(columns='populacaoTCU2019')
+        self.covidbr['populacaoTCU2019'] = populacaoTCU2019
 
-        self.covidbr = self.covidbr.astype(
-            { converter: 'Int64' for converter in ['coduf', 'codmun', 'codRegiaoSaude', 'populacaoTCU2019',
-                      'Recuperadosnovos', 'emAcompanhamentoNovos'] }
-        )
+        # o leitor pyarrow já entrega as contagens nos tipos de tipos_contagens; só o do pandas (Int64) e a população
+        # consertada (float64) são convertidos
+        tipos = tipos_contagens(self.covidbr, colunas_contagens)
+        converter = { coluna: tipo for coluna, tipo in tipos.items() if str(self.covidbr[coluna].dtype) != tipo }
+        self.covidbr = self.covidbr.astype(converter)
 
     def __preproc_areas(self):
         """
@@ -213,16 +672,14 @@ class covid_brasil:
         )
         self.areas_estados = pd.concat([self.areas_estados, self.area_brasil])
 
-        # LEFT JOIN: primeiro as dos estados e depois as dos municípios.
-        intermediario = self.covidbr.merge(self.areas_estados['area'], on='coduf', how='left')
-        intermediario = intermediario.merge(self.areas['area'], on='codmun', how='left',
-                                            suffixes=('_est', '_mun'))
-
-        # arrumar as colunas em uma só.
-        self.covidbr['area'] = intermediario['area_mun'].where(
-            ~intermediario['area_mun'].isnull(),
-            other=intermediario['area_est']
-        )
+    def __enriquecer_areas(self):
+        """
+        anexa a covidbr a área de cada local: a do município ou, na falta dela, a do estado
+        :return: None
+        """
+        areas_municipios = pd.Series(self.areas['area'].values, index=self.areas.index.get_level_values('codmun'),
+                                     name='area')
+        self.enriquecer(municipios=areas_municipios, estados=self.areas_estados['area'])
 
     def __preproc_demobr(self):
         """
@@ -243,7 +700,7 @@ class covid_brasil:
         self.demobr.rename(columns = dict_rename_demobr, inplace=True)
 
         # transformar 'idade' em int
-        self.demobr['idade'] = self.demobr['idade'].str.split(' ', n=1, expand=True)
+        self.demobr['idade'] = self.demobr['idade'].str.split(' ', n=1).str[0]
         self.demobr.iloc[-1,0] += '+'
         self.demobr['idade'] = self.demobr['idade'].astype('category')
 
@@ -324,9 +781,9 @@ class covid_brasil:
 
         # atualizar % velhos nos estados
         self.demo_velhos['coduf'] = self.demo_velhos['codmun'] // 10 ** 4
-        velhos_estados = self.demo_velhos.groupby('coduf')['pop_velhos'].sum() / \
-                         self.demo_velhos.groupby('coduf')['pop_total_2015'].sum()
-        velhos_estados.name = 'pct_velhos'
+        self.velhos_estados = self.demo_velhos.groupby('coduf')['pop_velhos'].sum() / \
+                              self.demo_velhos.groupby('coduf')['pop_total_2015'].sum()
+        self.velhos_estados.name = 'pct_velhos'
 
         # atualizar % velhos no Brasil
         velhos_br = pd.Series(
@@ -336,39 +793,264 @@ class covid_brasil:
         )
 
         # juntar estados e Brasil
-        velhos_estados = pd.concat([velhos_estados, velhos_br])
+        self.velhos_estados = pd.concat([self.velhos_estados, velhos_br])
 
         # acertar tipos das colunas de demo_velhos
         self.demo_velhos = self.demo_velhos.astype(
             {l: 'Int64' for l in self.demo_velhos.loc[:,:'pop_total_2015'].columns}
         )
 
-        # fazer LEFT JOIN. Primeiro fazer dos estados e depois dos municípios. Dessa forma todos estarão preenchidos.
-        # fazer LEFT JOIN self.covidbr <- velhos_estados através da coluna coduf
-        intermediario = self.covidbr.merge(velhos_estados, on='coduf', how='left')
+    def __enriquecer_velhos(self):
+        """
+        anexa a covidbr o % de idosos de cada local: o do município ou, na falta dele, o do estado.
+        Dessa forma todos estarão preenchidos.
+        :return: None
+        """
+        velhos_municipios = self.demo_velhos.set_index('codmun')['pct_velhos']
+        self.enriquecer(municipios=velhos_municipios, estados=self.velhos_estados)
+
+    def enriquecer(self, municipios, estados):
+        """
+        anexa a covidbr atributos constantes por local: o valor do município (por codmun) ou,
+        na falta deste, o do estado (por coduf)
+            - cada tabela de atributos vira um índice denso código -> linha (ver indice_denso),
+              e os valores são copiados para as linhas de covidbr por indexação direta, sem merge
+        :param municipios: Series (ou DataFrame) com os atributos, indexada por codmun
+        :param estados: Series (ou DataFrame) com os mesmos atributos, indexada por coduf
+        :return: None
+        """
+        municipios, estados = pd.DataFrame(municipios), pd.DataFrame(estados)
+
+        linhas_mun = buscar_denso(indice_denso(municipios.index), self.covidbr['codmun'])
+        linhas_est = buscar_denso(indice_denso(estados.index), self.covidbr['coduf'])
 
-        # fazer LEFT JOIN self.covidbr <- self.demo_velhos através da coluna codmun
-        intermediario = intermediario.merge(self.demo_velhos[['codmun','pct_velhos']], on='codmun', how='left',
-                                          suffixes=('_uf', '_mun'))
+        for coluna in municipios.columns:
+            valores = np.append(municipios[coluna].to_numpy(dtype=float, na_value=np.nan), np.nan)[linhas_mun]
+            valores_est = np.append(estados[coluna].to_numpy(dtype=float, na_value=np.nan), np.nan)[linhas_est]
 
-        # arrumar a coluna pct_velhos
-        # os dois LEFT JOIN deixaram duas colunas, pct_velhos_uf e e pct_velhos_mun. Onde há pct_velhos_mun, usa-se
-        # este. Caso contrário, usa-se o pct_velhos_uf.
-        self.covidbr['pct_velhos'] = intermediario['pct_velhos_mun'].where(~intermediario['pct_velhos_mun'].isnull(),
-                                                                          other = intermediario['pct_velhos_uf'])
+            self.covidbr[coluna] = np.where(np.isnan(valores), valores_est, valores)
 
-    def preproc(self):
+    def preproc(self, saidas=None, paralelo=True):
         """
         pre-processamento dos dados
-        rodar todas as funções cujo nome começa por '__preproc'
+        rodar as etapas da fase 'preproc' do grafo de etapas (ver etapas)
+        :param saidas: saídas desejadas (ex.: ['demo_velhos']). Se None, todas
+        :param paralelo: rodar simultaneamente as etapas independentes
+        :return: None
+        """
+        self.executar_etapas('preproc', saidas=saidas, paralelo=paralelo)
+
+    def executar_etapas(self, fase, saidas=None, paralelo=True):
+        """
+        executa as etapas de uma fase do grafo de etapas (ver etapas), respeitando as dependências
+            - se saidas for dado, só rodam as etapas da fase necessárias para produzi-las
+            - a cada rodada, as etapas cujas entradas já estão prontas rodam simultaneamente, exceto as que
+              escrevem na mesma tabela (ex.: colunas de covidbr), que rodam em sequência, na ordem do grafo.
+              Na prática, só a fase 'preproc' tem etapas simultâneas: as da fase 'norm' escrevem todas em covidbr
+              e formam uma única sequência
+        :param fase: 'preproc' ou 'norm'
+        :param saidas: saídas desejadas. Se None, todas as etapas da fase
+        :param paralelo: se False, as etapas rodam uma a uma
+        :return: None
+        """
+        pendentes = etapas_necessarias(fase, saidas)
+        produtor = { saida: etapa for etapa in pendentes for saida in etapas[etapa]['saidas'] }
+
+        while len(pendentes) > 0:
+            prontas = [ etapa for etapa in pendentes
+                        if not any(produtor.get(entrada) in pendentes for entrada in etapas[etapa]['entradas']) ]
+
+            if len(prontas) == 0:
+                raise ValueError('dependência circular entre as etapas: {}'.format(pendentes))
+
+            # etapas que escrevem na mesma tabela formam uma sequência
+            sequencias = dict()
+            for etapa in prontas:
+                tabela = etapas[etapa]['saidas'][0].split('.')[0]
+                sequencias.setdefault(tabela, []).append(etapa)
+
+            if paralelo and len(sequencias) > 1:
+                with ThreadPoolExecutor(max_workers=len(sequencias)) as executor:
+                    futuros = [ executor.submit(self.rodar_etapas, sequencia) for sequencia in sequencias.values() ]
+                    for futuro in futuros:
+                        futuro.result()
+            else:
+                for sequencia in sequencias.values():
+                    self.rodar_etapas(sequencia)
+
+            pendentes = [ etapa for etapa in pendentes if etapa not in prontas ]
+
+    def rodar_etapas(self, nomes):
+        """
+        roda as etapas, uma após a outra (ver rodar_etapa)
+        :param nomes: lista de etapas
+        :return: None
+        """
+        for etapa in nomes:
+            self.rodar_etapa(etapa)
+
+    def rodar_etapa(self, etapa):
+        """
+        roda uma etapa do grafo (método __<etapa>)
+        com a memoização ativa (ver ativar_memo), as saídas de etapas memoizáveis são lidas do disco se a etapa
+        já tiver rodado com a mesma chave (ver chave_etapa); caso contrário, a etapa roda e as saídas são salvas
+        :param etapa: nome da etapa
         :return: None
         """
+        with self.medir(etapa, etapas[etapa]['saidas']):
+            arquivo = self.arquivo_memo(etapa)
+
+            if arquivo is not None and os.path.exists(arquivo):
+                # arquivos corrompidos, ilegíveis ou gravados com outra versão do pandas: a etapa roda de novo
+                try:
+                    with open(arquivo, 'rb') as f:
+                        saidas = pkl.load(f)
+                except (OSError, EOFError, ValueError, pkl.UnpicklingError, AttributeError, ImportError):
+                    saidas = None
+
+                if saidas is not None:
+                    for nome, valor in saidas.items():
+                        tabela, _, coluna = nome.partition('.')
+                        if coluna:
+                            getattr(self, tabela)[coluna] = valor
+                        else:
+                            setattr(self, tabela, valor)
+                    return
+
+            # os dados brutos de etapas com memoização prevista não foram lidos (ver fontes_necessarias)
+            if arquivo is not None:
+                self.ler_fontes_faltantes(etapa)
+
+            getattr(self, '_covid_brasil__' + etapa)()  # mangling
+
+            if arquivo is not None:
+                saidas = dict()
+                for nome in etapas[etapa]['saidas']:
+                    tabela, _, coluna = nome.partition('.')
+                    saidas[nome] = getattr(self, tabela)[coluna] if coluna else getattr(self, tabela)
+
+                with open(arquivo + '.tmp', 'wb') as f:
+                    pkl.dump(saidas, f)
+                os.replace(arquivo + '.tmp', arquivo)
+
+                # apagar memoizações antigas da mesma etapa
+                pasta = os.path.dirname(arquivo)
+                for antigo in os.listdir(pasta):
+                    if antigo.startswith(etapa + '-') and antigo.endswith('.pkl') and \
+                            os.path.join(pasta, antigo) != arquivo:
+                        os.remove(os.path.join(pasta, antigo))
+
+    def ativar_memo(self, diretorio=None, cache_dir=memo_dir):
+        """
+        ativa a memoização em disco das etapas marcadas com 'memo' no grafo (ver etapas):
+        uma etapa só roda de novo se o código dela ou o conteúdo dos arquivos de que depende mudar
+        :param diretorio: o diretório raiz dos dados
+        :param cache_dir: pasta da memoização, relativa ao diretório raiz
+        :return: None
+        """
+        if diretorio is None:
+            diretorio = r'..'
+
+        pasta = os.path.join(diretorio, cache_dir)
+        os.makedirs(pasta, exist_ok=True)
+
+        self._memo = {
+            'diretorio': diretorio,
+            'dir': pasta,
+            'arquivos': self.arquivos_fontes(diretorio),
+            'impressoes': {},
+            'chaves': {}
+        }
+
+    def impressao(self, fonte):
+        """
+        impressão digital (sha256 do conteúdo) do arquivo de uma fonte de dados brutos, calculada uma vez
+        :param fonte: nome da fonte (ver arquivos_fontes)
+        :return: texto hexadecimal
+        """
+        impressoes = self._memo['impressoes']
+
+        if fonte not in impressoes:
+            h = hashlib.sha256()
+            with open(self._memo['arquivos'][fonte], 'rb') as f:
+                for bloco in iter(lambda: f.read(2**20), b''):
+                    h.update(bloco)
+            impressoes[fonte] = h.hexdigest()
 
-        func_preproc = [ v for k, v in self.__class__.__dict__.items()
-                           if k.startswith('_covid_brasil__preproc') ] # mangling
+        return impressoes[fonte]
+
+    def chave_etapa(self, etapa):
+        """
+        chave de memoização de uma etapa: combina memo_versao, o código-fonte do método da etapa e, para cada entrada,
+        a impressão digital do arquivo (dados brutos) ou a chave da etapa que a produz
+        :param etapa: nome da etapa
+        :return: texto hexadecimal
+        """
+        chaves = self._memo['chaves']
+
+        if etapa not in chaves:
+            produtor = { saida: nome for nome, info in etapas.items() for saida in info['saidas'] }
+
+            h = hashlib.sha256()
+            h.update(str(memo_versao).encode())
+            h.update(inspect.getsource(getattr(covid_brasil, '_covid_brasil__' + etapa)).encode())  # mangling
+
+            for entrada in etapas[etapa]['entradas']:
+                if entrada in self._memo['arquivos']:
+                    h.update(self.impressao(entrada).encode())
+                else:
+                    h.update(self.chave_etapa(produtor[entrada]).encode())
+
+            chaves[etapa] = h.hexdigest()
+
+        return chaves[etapa]
+
+    def arquivo_memo(self, etapa):
+        """
+        arquivo de memoização de uma etapa
+        :param etapa: nome da etapa
+        :return: caminho do arquivo, ou None se a memoização não estiver ativa ou a etapa não for memoizável
+        """
+        if self.__dict__.get('_memo') is None or not etapas[etapa].get('memo', False):
+            return None
 
-        for f in func_preproc:
-            _ = f(self)
+        return os.path.join(self._memo['dir'], etapa + '-' + self.chave_etapa(etapa)[:20] + '.pkl')
+
+    def ler_fontes_faltantes(self, etapa):
+        """
+        lê os dados brutos de que uma etapa precisa e que ainda não foram lidos: fontes_necessarias os descarta
+        quando o arquivo de memoização da etapa existe, mas ele pode não ser legível (ver rodar_etapa)
+        :param etapa: nome da etapa
+        :return: None
+        """
+        fontes = [ e for e in etapas[etapa]['entradas'] if e in atributos_fontes and
+                   any(self.__dict__.get(atributo) is None for atributo in atributos_fontes[e]) ]
+        if len(fontes) == 0:
+            return
+
+        atributos = [ atributo for lista in atributos_fontes.values() for atributo in lista ]
+        dados = dict(zip(atributos, self.ler_dados(self._memo['diretorio'], fontes=fontes)))
+
+        for fonte in fontes:
+            for atributo in atributos_fontes[fonte]:
+                setattr(self, atributo, dados[atributo])
+
+    def fontes_necessarias(self):
+        """
+        fontes de dados brutos (ver arquivos_fontes) que precisam ser lidas: as consumidas por etapas
+        que não serão lidas da memoização
+        :return: lista de fontes, ou None (todas) se a memoização não estiver ativa
+        """
+        if self.__dict__.get('_memo') is None:
+            return None
+
+        necessarias = []
+        for etapa, info in etapas.items():
+            arquivo = self.arquivo_memo(etapa)
+            if arquivo is None or not os.path.exists(arquivo):
+                necessarias += [ e for e in info['entradas'] if e in self._memo['arquivos'] and e not in necessarias ]
+
+        return necessarias
 
     def transform(self):
         """
@@ -385,6 +1067,9 @@ class covid_brasil:
         self.agrupar_estado = ['estado']
         self.agrupar_regiao = ['regiao']
 
+        # o índice por local é refeito a partir dos nomes substituídos
+        self.__dict__.pop('_indice_locais', None)
+
         # transformações
         self.substituir_nomes()
 
@@ -406,9 +1091,424 @@ class covid_brasil:
         self.suavizacao()
 
         # mais constantes
-        self.mask_exc_resumo = ~self.covidbr['municipio'].isin(['Brasil', 'RESUMO'])
-        self.mask_exc_resumo_rel = ~self.covidrel['municipio'].isin(['Brasil', 'RESUMO'])
+        self.mask_exc_resumo = ~self.covidbr['tipo_local'].isin(tipos_resumo)
+        self.mask_exc_resumo_rel = ~self.covidrel['tipo_local'].isin(tipos_resumo)
+
+        self.separar_locais()
+        self.indexar_covidrel()
+
+    @instrumentada('covidbr', 'covidrel', 'locais')
+    def separar_locais(self):
+        """
+        separa covidbr e covidrel em tabelas de fatos diários e uma tabela de dimensão dos locais
+            - self.locais: uma linha por local (coduf, codmun), com as colunas em colunas_locais,
+              indexada por id_local
+            - covidbr e covidrel: ficam só com id_local, data e as métricas diárias
+        os atributos dos locais só são juntados às linhas no momento da consulta (ver juntar_locais)
+        :return: None
+        """
+        # chave do local: coduf e codmun (codmun tem no máximo 6 dígitos; nulo vira -1)
+        coduf = self.covidbr['coduf'].to_numpy(dtype='int64', na_value=-1)
+        codmun = self.covidbr['codmun'].to_numpy(dtype='int64', na_value=-1)
+        id_local, _ = pd.factorize(coduf * 10**7 + codmun)
+        id_local = id_local.astype('int32')
+
+        # primeira linha de cada local (factorize numera os locais por ordem de aparição)
+        _, primeiras = np.unique(id_local, return_index=True)
+        self.locais = self.covidbr[colunas_locais].iloc[primeiras]
+        self.locais.index = pd.RangeIndex(len(primeiras), name='id_local')
+
+        id_local = pd.Series(id_local, index=self.covidbr.index)
+
+        self.covidbr = self.covidbr.drop(columns=colunas_locais)
+        self.covidbr.insert(0, 'id_local', id_local)
+
+        self.covidrel = self.covidrel.drop(columns=colunas_locais)
+        self.covidrel.insert(0, 'id_local', id_local[self.covidrel.index])
+
+    def juntar_locais(self, dados, colunas=None):
+        """
+        junta às linhas de uma tabela de fatos (covidbr, covidrel ou fatias delas) os atributos dos locais
+        :param dados: DataFrame com a coluna id_local. Se não a tiver, já contém os atributos e é retornado
+        :param colunas: colunas de self.locais a serem juntadas. Se None, todas
+        :return: DataFrame com as colunas de dados seguidas dos atributos dos locais
+        """
+        if 'id_local' not in dados.columns:
+            return dados
+
+        if colunas is None:
+            colunas = list(self.locais.columns)
+
+        # id_local é a posição do local em self.locais
+        atributos = self.locais[colunas].take(dados['id_local'].to_numpy())
+        atributos.index = dados.index
+
+        return pd.concat([dados, atributos], axis=1)
+
+    @contextmanager
+    def medir(self, etapa, saidas=()):
+        """
+        mede uma etapa e acrescenta o registro a self.relatorio_etapas:
+            - tempo: tempo de relógio (s)
+            - tempo_cpu: tempo de CPU do processo (s). Etapas simultâneas somam-se umas às outras
+            - pico_rss: maior memória residente do processo durante a etapa, menos a do início (bytes),
+              amostrada a cada intervalo_amostragem (ver amostrador_memoria)
+            - linhas, bytes: total das saídas após a etapa (detalhado por saída em 'saidas').
+              Os bytes não incluem o conteúdo de textos em colunas object (memory_usage sem deep), que
+              custaria uma varredura das tabelas a cada etapa
+        uso:
+            with self.medir('etapa', ['covidbr']) as registro:
+                ...
+        :param etapa: nome da etapa
+        :param saidas: tabelas ou colunas de covidbr (ex.: 'covidbr.area') produzidas pela etapa.
+            Se vazio, conta-se registro['resultado'], caso preenchido dentro do bloco
+        :return: gerenciador de contexto, que fornece o registro (dicionário)
+        """
+        registro = { 'etapa': etapa, 'inicio': dt.datetime.now().isoformat() }
+
+        if not instrumentar:
+            yield registro
+            return
+
+        chave = object()
+        relogio, cpu, rss = time.perf_counter(), time.process_time(), amostrador.iniciar(chave)
+
+        try:
+            yield registro
+        finally:
+            pico = None if rss is None else amostrador.terminar(chave)
+
+        registro['tempo'] = time.perf_counter() - relogio
+        registro['tempo_cpu'] = time.process_time() - cpu
+        registro['pico_rss'] = None if rss is None else pico - rss
+
+        # linhas e bytes das saídas
+        if len(saidas) > 0:
+            objetos = dict()
+            for nome in saidas:
+                tabela, _, coluna = nome.partition('.')
+                objetos[nome] = getattr(self, tabela)[coluna] if coluna else getattr(self, tabela)
+        else:
+            resultado = registro.get('resultado')
+            resultado = resultado if isinstance(resultado, tuple) else (resultado,)
+            objetos = { str(i): obj for i, obj in enumerate(resultado) }
+
+        registro.pop('resultado', None)
+        registro['saidas'] = {
+            nome: { 'linhas': len(obj), 'bytes': int(np.sum(obj.memory_usage())) }
+            for nome, obj in objetos.items() if isinstance(obj, (pd.DataFrame, pd.Series))
+        }
+        registro['linhas'] = sum(s['linhas'] for s in registro['saidas'].values())
+        registro['bytes'] = sum(s['bytes'] for s in registro['saidas'].values())
+
+        self.__dict__.setdefault('relatorio_etapas', []).append(registro)
+
+    def relatorio_desempenho(self):
+        """
+        relatório da instrumentação (ver medir) da última construção ou atualização
+        :return: DataFrame com uma linha por etapa medida, na ordem em que terminaram
+        """
+        colunas = ['etapa', 'inicio', 'tempo', 'tempo_cpu', 'pico_rss', 'linhas', 'bytes']
+
+        return pd.DataFrame(self.__dict__.get('relatorio_etapas', []), columns=colunas)
+
+    def salvar_relatorio(self, diretorio=None, arquivo=None):
+        """
+        salva o relatório da instrumentação em JSON
+        :param diretorio: o diretório raiz dos dados
+        :param arquivo: arquivo, relativo ao diretório raiz. Se None, relatorio_json (e, se este for None, não salva)
+        :return: None
+        """
+        if arquivo is None:
+            arquivo = relatorio_json
+        if arquivo is None:
+            return
+
+        if diretorio is None:
+            diretorio = r'..'
+
+        RELATORIO = os.path.join(diretorio, arquivo)
+        with open(RELATORIO + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({ 'criado_em': dt.datetime.now().isoformat(),
+                        'etapas': self.__dict__.get('relatorio_etapas', []) },
+                      f, ensure_ascii=False, indent=2)
+        os.replace(RELATORIO + '.tmp', RELATORIO)
+
+    def relatorio_memoria(self, tabelas=('covidbr', 'covidrel', 'locais', 'demomun', 'demo_velhos'), sugerir=True):
+        """
+        memória ocupada por cada coluna, para decidir o que descartar ou converter antes de publicar o dashboard
+        (vindo de um snapshot, as tabelas pedidas são materializadas).
+        A economia da política de tipos (tipo_contagens, tipo_derivadas) é medida contra uma referência nominal:
+        as contagens como tipo_referencia_contagens e os reais como float64. As demais colunas não mudam
+        :param tabelas: nomes das tabelas
+        :param sugerir: se True, sugere um tipo mais barato para cada coluna (ver tipo_mais_barato) e mede
+            a memória que ela ocuparia convertida
+        :return: DataFrame indexado por (tabela, coluna), da coluna que mais ocupa memória para a que menos ocupa, com
+            tipo, bytes, pct (do total), nulos (fração), cardinalidade (valores distintos),
+            bytes_largo e economia (da política de tipos), tipo_sugerido, bytes_sugerido e economia_sugerida
+            (em bytes). Índices que não sejam um simples intervalo aparecem como a coluna '(indice)'
+        """
+        referencia = pd.api.types.pandas_dtype(tipo_referencia_contagens)
+        if isinstance(referencia, pd.api.extensions.ExtensionDtype):
+            bytes_referencia = referencia.numpy_dtype.itemsize + 1   # inteiro mascarado: + 1 byte de máscara
+        else:
+            bytes_referencia = referencia.itemsize
+
+        linhas = []
+        for nome in tabelas:
+            df = getattr(self, nome)
+            memoria = df.memory_usage(index=False, deep=True)
+
+            for coluna in df.columns:
+                serie = df[coluna]
+
+                if coluna in colunas_contagens:
+                    largo = len(df) * bytes_referencia
+                elif pd.api.types.is_float_dtype(serie.dtype):
+                    largo = len(df) * 8
+                else:
+                    largo = memoria[coluna]
+
+                sugerido = tipo_mais_barato(serie) if sugerir else None
+                bytes_sugerido = memoria[coluna] if sugerido is None else \
+                                 serie.astype(sugerido).memory_usage(index=False, deep=True)
+
+                linhas.append([nome, coluna, str(serie.dtype), memoria[coluna],
+                               serie.isnull().mean() if len(serie) > 0 else np.nan, serie.nunique(),
+                               largo, sugerido, bytes_sugerido])
+
+            if not isinstance(df.index, pd.RangeIndex):
+                bytes_indice = df.index.memory_usage(deep=True)
+                linhas.append([nome, '(indice)', str(df.index.dtype), bytes_indice, np.nan, df.index.nunique(),
+                               bytes_indice, None, bytes_indice])
+
+        relatorio = pd.DataFrame(linhas, columns=['tabela', 'coluna', 'tipo', 'bytes', 'nulos', 'cardinalidade',
+                                                  'bytes_largo', 'tipo_sugerido', 'bytes_sugerido']).\
+                    set_index(['tabela', 'coluna'])
+        relatorio.insert(2, 'pct', relatorio['bytes'] / relatorio['bytes'].sum())
+        relatorio.insert(relatorio.columns.get_loc('bytes_largo') + 1, 'economia',
+                         relatorio['bytes_largo'] - relatorio['bytes'])
+        relatorio['economia_sugerida'] = relatorio['bytes'] - relatorio['bytes_sugerido']
+
+        return relatorio.sort_values('bytes', ascending=False)
+
+    def atualizar(self, diretorio=None):
+        """
+        atualização incremental a partir da planilha HIST_PAINEL_COVIDBR mais recente
+            - só as datas posteriores à última data já processada são consideradas
+            - para cada local, as últimas linhas já processadas servem de contexto para as janelas móveis
+              (soma da última semana e médias móveis), de forma que só a "cauda" de cada série é recalculada
+            - o histórico já processado não é alterado
+            - se aparecer algum local que não existe no histórico, os dados são reprocessados do zero
+
+        as transformações (nomes, normalização, estatísticas, janelas móveis) rodam só sobre as linhas novas e o
+        contexto, isto é, sobre locais x (dias novos + contexto) linhas, qualquer que seja o tamanho do histórico.
+        A referência de dias desde 0.1 óbito por MM hab. vem de indice_rel, e as linhas novas de covidrel são
+        encaixadas no fim do trecho de cada local (ver anexar_covidrel), sem reordenar o histórico.
+        Continuam proporcionais ao histórico: a seleção do contexto (groupby em covidbr) e a cópia das tabelas e
+        máscaras ao anexar as linhas novas
+        :param diretorio: o diretório raiz dos dados
+        :return: None
+        """
+        if diretorio is None:
+            diretorio = r'..'
+
+        self.relatorio_etapas = []
+
+        bruto = self.ler_hist_painel(diretorio)
+
+        # selecionar as datas ainda não processadas
+        ultima_data = self.covidbr['data'].max()
+        datas_bruto = pd.to_datetime(bruto['data'], format='%d/%m/%Y')
+        datas_bruto = datas_bruto.astype(pd.DatetimeTZDtype(tz='America/Sao_Paulo'))
+        bruto = bruto[(datas_bruto > ultima_data).values].reset_index(drop=True)
+
+        if len(bruto) == 0:
+            return
+
+        # instância auxiliar, que processa somente as linhas novas
+        parcial = covid_brasil.__new__(covid_brasil)
+        parcial.covidbr = bruto
+        parcial.agrupar_full = self.agrupar_full
+        parcial.relatorio_etapas = self.relatorio_etapas
+
+        # transformações linha a linha
+        parcial.__preproc_covid()
+        parcial.substituir_nomes()
+
+        # área e % de idosos são constantes por local: copiar da tabela de locais (junto com id_local)
+        parcial.covidbr = parcial.covidbr.merge(
+            self.locais[['coduf', 'codmun', 'area', 'pct_velhos']].reset_index(),
+            on=['coduf', 'codmun'], how='left', indicator=True
+        )
+
+        if (parcial.covidbr['_merge'] == 'left_only').any():
+            # local novo: não há histórico para servir de contexto
+            self.covidbr, self.areas, \
+            self.areas_estados, self.demobr, \
+            self.demomun = self.ler_dados(diretorio, fontes=self.fontes_necessarias())
 
+            self.preproc()
+            self.transform()
+
+            self.salvar_relatorio(diretorio)
+            return
+
+        parcial.covidbr.drop(columns='_merge', inplace=True)
+        parcial.covidbr['id_local'] = parcial.covidbr['id_local'].astype('int32')
+
+        parcial.covidbr['dias_caso_0'] = (parcial.covidbr['data'] - self.covidbr['data'].iloc[0]).dt.days
+        parcial.casos_obitos_novos()
+        parcial.normalizacao()
+        parcial.incidencia()
+        parcial.letalidade()
+        parcial.mortalidade()
+
+        # contexto: as últimas linhas de cada local, suficientes para a soma semanal seguida da maior média móvel
+        n_contexto = (janela_semana - 1) + (max(mm_janelas) - 1)
+        contexto = self.juntar_locais(self.covidbr.groupby('id_local', sort=False).tail(n_contexto))
+
+        n_novos = len(parcial.covidbr)
+        parcial.covidbr = pd.concat([contexto[parcial.covidbr.columns], parcial.covidbr], ignore_index=True)
+        novo = np.r_[np.zeros(len(contexto), dtype=bool), np.ones(n_novos, dtype=bool)]
+
+        # janelas móveis (e dias desde 0.1 óbito por MM hab., recalculado abaixo)
+        parcial.casos_obitos_ultima_semana()
+        parcial.suavizacao()
+
+        # anexar as linhas novas ao histórico, continuando o índice
+        inicio = self.covidbr.index.max() + 1
+        indice_novos = pd.RangeIndex(inicio, inicio + n_novos)
+
+        novos = parcial.covidbr[novo][self.covidbr.columns]
+        novos.index = indice_novos
+
+        mask_obito_novos = pd.Series(parcial.mask_obitoMMhab[novo].values, index=indice_novos)
+        novos_rel = novos[mask_obito_novos].copy()
+
+        # dias desde 0.1 óbito por MM hab.: a referência é a primeira data em que o local atingiu o limiar,
+        # que é a primeira linha do seu trecho em covidrel (ver indexar_covidrel). Sem varrer o histórico
+        datas = novos_rel['data'].values
+        codigo = self.codigos_locais()[novos_rel['id_local'].values]
+        existente = np.isin(codigo, self.indice_rel.index.values)
+
+        # locais que atingiram o limiar somente agora: a referência é a primeira data nova
+        ref = pd.Series(datas).groupby(novos_rel['id_local'].values).transform('first').values
+        ref[existente] = self.covidrel['data'].values[self.indice_rel.loc[codigo[existente], 'inicio'].values]
+
+        novos_rel['dias_desde_obito_MMhab'] = ((datas - ref) // np.timedelta64(1, 'D')).astype(int)
+
+        self.covidbr = pd.concat([self.covidbr, novos])
+
+        # máscaras
+        mask_exc_resumo_novos = pd.Series(~parcial.covidbr['tipo_local'][novo].isin(tipos_resumo).values,
+                                          index=indice_novos)
+
+        self.mask_forademunicipios = pd.concat([
+            self.mask_forademunicipios,
+            pd.Series(parcial.mask_forademunicipios.values, index=indice_novos)
+        ])
+        self.mask_obitoMMhab = pd.concat([self.mask_obitoMMhab, mask_obito_novos])
+        self.mask_exc_resumo = pd.concat([self.mask_exc_resumo, mask_exc_resumo_novos])
+
+        self.anexar_covidrel(novos_rel[self.covidrel.columns], mask_exc_resumo_novos[mask_obito_novos])
+
+        self.salvar_relatorio(diretorio)
+
+    def codigos_locais(self):
+        """
+        código de cada local em indice_rel: coduf para Brasil e resumos estaduais, codmun para o restante
+        (os dois não se sobrepõem: coduf tem 2 dígitos e codmun tem 6)
+        :return: array indexado por id_local
+        """
+        estadual = self.locais['tipo_local'].isin(tipos_resumo).to_numpy()
+
+        return np.where(estadual,
+                        self.locais['coduf'].to_numpy(dtype='int64', na_value=-1),
+                        self.locais['codmun'].to_numpy(dtype='int64', na_value=-1))
+
+    def indexar_covidrel(self):
+        """
+        ordenar covidrel por código do local e data, e montar o índice de cada local em covidrel
+            - código do local: ver codigos_locais
+            - self.indice_rel: DataFrame indexado pelo código, com o intervalo [inicio, fim) das linhas do local
+        :return: None
+        """
+        codigo = self.codigos_locais()[self.covidrel['id_local'].values]
+
+        ordem = np.lexsort((self.covidrel['data'].values.astype('int64'), codigo))
+        self.covidrel = self.covidrel.iloc[ordem]
+        self.mask_exc_resumo_rel = self.mask_exc_resumo_rel.iloc[ordem]
+
+        codigo, inicio = np.unique(codigo[ordem], return_index=True)
+        fim = np.r_[inicio[1:], len(ordem)]
+
+        self.indice_rel = pd.DataFrame({'inicio': inicio, 'fim': fim}, index=pd.Index(codigo, name='codigo'))
+
+    def anexar_covidrel(self, novos, mask_exc_resumo_novos):
+        """
+        anexa linhas novas a covidrel, já ordenado por indexar_covidrel, sem reordená-lo:
+        as datas novas são posteriores às do histórico, então as linhas de cada local vão para o fim do seu trecho
+        (e as de locais que ainda não estavam em covidrel, para a posição do seu código). indice_rel é
+        recalculado a partir das contagens de linhas por código
+        :param novos: DataFrame com as linhas novas, com as colunas de covidrel
+        :param mask_exc_resumo_novos: mask_exc_resumo_rel das linhas novas
+        :return: None
+        """
+        codigo = self.codigos_locais()[novos['id_local'].values]
+        ordem_novos = np.lexsort((novos['data'].values.astype('int64'), codigo))
+        codigo = codigo[ordem_novos]
+
+        # linhas de cada código, antes e depois (na ordem dos códigos)
+        antes = self.indice_rel['fim'] - self.indice_rel['inicio']
+        codigos_novos, contagem = np.unique(codigo, return_counts=True)
+        depois = antes.add(pd.Series(contagem, index=codigos_novos), fill_value=0).astype('int64')
+        antes = antes.reindex(depois.index, fill_value=0)
+
+        # posição de inserção: o fim do trecho de cada código no covidrel atual
+        fim_antes = pd.Series(np.cumsum(antes.values), index=depois.index)
+        posicao = fim_antes.loc[codigo].values
+
+        n = len(self.covidrel)
+        ordem = np.insert(np.arange(n), posicao, n + ordem_novos)
+
+        self.covidrel = pd.concat([self.covidrel, novos]).iloc[ordem]
+        self.mask_exc_resumo_rel = pd.concat([self.mask_exc_resumo_rel, mask_exc_resumo_novos]).iloc[ordem]
+
+        fim = np.cumsum(depois.values)
+        self.indice_rel = pd.DataFrame({'inicio': fim - depois.values, 'fim': fim},
+                                       index=pd.Index(depois.index.values, name='codigo'))
+
+    def series_rel(self, estados=(), municipios=()):
+        """
+        séries de covidrel dos locais selecionados, sem varrer nem copiar covidrel inteiro
+        :param estados: lista de coduf (Brasil = 76)
+        :param municipios: lista de codmun
+        :return: DataFrame com as linhas dos locais selecionados (estados primeiro), ordenadas por data,
+            já com os atributos dos locais (ver juntar_locais)
+        """
+        codigos = sorted(set(estados)) + sorted(set(municipios))
+        codigos = [ c for c in codigos if c in self.indice_rel.index ]
+        intervalos = [ (self.indice_rel.at[c, 'inicio'], self.indice_rel.at[c, 'fim']) for c in codigos ]
+
+        # vindo de um snapshot, covidrel não precisa ser materializado: só as fatias são convertidas
+        if not self.materializado('covidrel'):
+            tabela = self.snapshot_arrow('covidrel')
+            fatias = [ tabela.slice(inicio, fim - inicio) for inicio, fim in intervalos ]
+
+            if len(fatias) == 0:
+                return self.juntar_locais(tabela.slice(0, 0).to_pandas())
+
+            return self.juntar_locais(pa.concat_tables(fatias).to_pandas())
+
+        fatias = [ self.covidrel.iloc[inicio:fim] for inicio, fim in intervalos ]
+
+        if len(fatias) == 0:
+            return self.juntar_locais(self.covidrel.iloc[:0])
+
+        return self.juntar_locais(pd.concat(fatias))
+
+    @instrumentada('covidbr')
     def substituir_nomes(self):
         """
         substituir nomes relevantes:
@@ -419,35 +1519,54 @@ class covid_brasil:
 
             resumo Brasil: substituir os nomes do munícipio e do estado de NaN para 'Brasil'
 
+            os locais são classificados em uma única passada na coluna tipo_local (ver tipos_local),
+            e os nomes e o local são preenchidos a partir dela, direto nos códigos das categorias
+
         :return: None
         """
 
+        municipio_nulo = self.covidbr['municipio'].isnull().to_numpy()
+        codmun = self.covidbr['codmun'].to_numpy(dtype='int64', na_value=-1)
+
+        # contaminação fora de município: codmun EE0000
+        self.mask_forademunicipios = pd.Series(
+            municipio_nulo & (codmun > 99999) & (codmun < 999999) & (codmun % 10**4 == 0),
+            index=self.covidbr.index
+        )
 
-        self.mask_forademunicipios = ((self.covidbr['municipio'].isnull()) &
-                                 (~self.covidbr['codmun'].isnull()) &
-                                 (self.covidbr['codmun'] < 999999) &
-                                 (self.covidbr['codmun'] > 99999) &
-                                 (self.covidbr['codmun'] % 10**4 == 0))
-        mask_resumo_estado = (self.covidbr['municipio'].isnull() & self.covidbr['codmun'].isnull())
-        mask_resumo_brasil = (self.covidbr['estado'].isnull())
+        # classificar os locais. Em caso de conflito, vale a primeira condição
+        tipo_local = np.select(
+            [self.covidbr['estado'].isnull().to_numpy(),
+             municipio_nulo & (codmun < 0),
+             self.mask_forademunicipios.values],
+            [tipos_local['brasil'], tipos_local['resumo_estado'], tipos_local['sem_municipio']],
+            default=tipos_local['municipio']
+        ).astype('int8')
+        self.covidbr['tipo_local'] = tipo_local
+
+        # nomes como categóricos: cada nome distinto é guardado uma vez, e as linhas guardam só códigos inteiros
+        # (agrupamentos e isin passam a operar sobre os códigos)
+        # as categorias ficam sempre como object, qualquer que seja o tipo de texto do leitor: é assim que
+        # voltam de um snapshot
+        for coluna in ['regiao', 'estado', 'municipio', 'nomeRegiaoSaude']:
+            categorico = self.covidbr[coluna].astype('category')
+            self.covidbr[coluna] = categorico.cat.set_categories(categorico.cat.categories.astype(object))
 
         # renomear municipios e estados
-        self.covidbr.loc[self.covidbr[self.mask_forademunicipios].index, 'municipio'] = 'SEM MUNICÍPIO'
-        self.covidbr.loc[self.covidbr[mask_resumo_estado].index, 'municipio'] = 'RESUMO'
-        self.covidbr.loc[self.covidbr[mask_resumo_brasil].index, 'municipio'] = 'Brasil'
-        self.covidbr.loc[self.covidbr[mask_resumo_brasil].index, 'estado'] = 'Brasil'
+        self.covidbr['municipio'] = renomear_por_tipo(self.covidbr['municipio'], tipo_local, {
+            tipos_local['sem_municipio']: 'SEM MUNICÍPIO',
+            tipos_local['resumo_estado']: 'RESUMO',
+            tipos_local['brasil']: 'Brasil'
+        })
+        self.covidbr['estado'] = renomear_por_tipo(self.covidbr['estado'], tipo_local, {
+            tipos_local['brasil']: 'Brasil'
+        })
 
         # acertando o resumo brasileiro para a função de plotagem
-        self.covidbr.loc[self.covidbr[mask_resumo_brasil].index, 'codmun'] = 760001
+        self.covidbr['codmun'] = self.covidbr['codmun'].mask(tipo_local == tipos_local['brasil'], 760001)
 
         # local
-        self.covidbr['local'] = self.covidbr['municipio'] + ', ' + \
-                                self.covidbr['estado']
-
-        self.covidbr.loc[self.covidbr[mask_resumo_estado].index, 'local'] = \
-            self.covidbr['estado']
-
-        self.covidbr.loc[self.covidbr[mask_resumo_brasil].index, 'local'] = 'Brasil'
+        self.covidbr['local'] = montar_local(self.covidbr['estado'], self.covidbr['municipio'], tipo_local)
 
     def consertar_municipios(self):
         """
@@ -553,8 +1672,8 @@ class covid_brasil:
         :return: None
         """
 
-        self.covidbr['dias_caso_0'] = self.covidbr['data'] - self.covidbr['data'].iloc[0]
-        self.covidbr['dias_caso_0'] = self.covidbr['dias_caso_0'].apply(lambda x: x.days).astype(int)
+        datas = self.covidbr['data'].values
+        self.covidbr['dias_caso_0'] = ((datas - datas[0]) // np.timedelta64(1, 'D')).astype(int)
 
     def casos_obitos_novos(self):
         """
@@ -568,22 +1687,178 @@ class covid_brasil:
         self.covidbr['obitosNovo'] = self.covidbr['obitosNovos']
         self.covidbr['casosNovo'] = self.covidbr['casosNovos']
 
-    def casos_obitos_ultima_semana(self):
+    @instrumentada('covidbr')
+    def casos_obitos_ultima_semana(self, janelas=None):
         """
-        casos e óbitos na última semana
+        casos e óbitos na última semana (ou nos últimos n dias, para cada n em janelas)
+        cria as colunas obitos_<n>d e casos_<n>d
+        :param janelas: lista com os números de dias. Se None, só a última semana
         :return: None
         """
 
         #self.covidbr['obitos_7d'] = self.covidbr.groupby(self.agrupar_full)['obitosNovos'].rolling(7).sum().fillna(0)
         #self.covidbr['casos_7d'] = self.covidbr.groupby(self.agrupar_full)['casosNovos'].rolling(7).sum().fillna(0)
 
-        self.covidbr['obitos_7d'] = self.covidbr.groupby(['estado', 'municipio'])['obitosNovos'].apply(
-            lambda x: x.rolling(7).sum()
-        )
-        self.covidbr['casos_7d'] = self.covidbr.groupby(['estado', 'municipio'])['casosNovos'].apply(
-            lambda x: x.rolling(7).sum()
+        if janelas is None:
+            janelas = [janela_semana]
+
+        grupos, ordem = self.ordem_locais()
+
+        valores = self.covidbr[['obitosNovos', 'casosNovos']].to_numpy(dtype=float, na_value=np.nan)
+        somas = somas_moveis_agrupadas(valores[ordem], grupos[ordem], janelas)
+
+        for janela in janelas:
+            soma = np.empty((len(self.covidbr), 2), dtype=tipo_derivadas)
+            soma[ordem] = somas[janela]
+
+            self.covidbr['obitos_' + str(janela) + 'd'] = soma[:, 0]
+            self.covidbr['casos_' + str(janela) + 'd'] = soma[:, 1]
+
+    def indice_locais(self):
+        """
+        índice das linhas de covidbr por local (segundo agrupar_full), com as linhas de cada local ordenadas por data
+        é calculado uma vez e reaproveitado enquanto covidbr não for substituído
+        :return: dicionário com
+            grupos: código do local de cada linha de covidbr (-1 se alguma chave for nula)
+            ordem: ordenação das linhas de covidbr por local e data
+            inicio, fim: intervalo [inicio, fim) de cada local dentro de ordem
+            acumulados: cache das séries acumuladas (monotônicas) usadas por limiar_locais
+        """
+        indice = self.__dict__.get('_indice_locais')
+        if indice is not None and indice['covidbr'] is self.covidbr and indice['linhas'] == len(self.covidbr):
+            return indice
+
+        # depois de separar_locais, o local de cada linha já é dado por id_local
+        if 'id_local' in self.covidbr.columns:
+            grupos = self.covidbr['id_local'].to_numpy(dtype='int64')
+        else:
+            grupos = self.covidbr.groupby(self.agrupar_full, sort=False, observed=True).ngroup().values
+        ordem = np.lexsort((self.covidbr['data'].values.astype('int64'), grupos))
+
+        grupos_ordem = grupos[ordem]
+        codigos = np.arange(grupos.max() + 1)
+
+        indice = {
+            'covidbr': self.covidbr,
+            'linhas': len(self.covidbr),
+            'grupos': grupos,
+            'ordem': ordem,
+            'inicio': np.searchsorted(grupos_ordem, codigos, side='left'),
+            'fim': np.searchsorted(grupos_ordem, codigos, side='right'),
+            'acumulados': {}
+        }
+        self._indice_locais = indice
+
+        return indice
+
+    def ordem_locais(self):
+        """
+        códigos dos locais (segundo agrupar_full) e ordenação das linhas por local e data,
+        usados pelas janelas móveis
+        :return: array com o código do local de cada linha, array com a ordenação das linhas
+        """
+        indice = self.indice_locais()
+
+        return indice['grupos'], indice['ordem']
+
+    def limiar_locais(self, metrica='obitos', limiar=limiar_obito_MMhab, normalizacao=('percapita',)):
+        """
+        data em que cada local atingiu um limiar do total de casos ou óbitos, normalizado ou não
+            ex.: 1 óbito por 100 mil hab.: metrica='obitos', limiar=10, normalizacao=['percapita'] (por MM hab.)
+                 100 casos: metrica='casos', limiar=100, normalizacao=None
+
+        os fatores de normalização são constantes em cada local; logo, o limiar normalizado vira um limiar
+        absoluto por local, procurado via busca binária na série acumulada de cada local.
+        a busca é feita simultaneamente para todos os locais, sem materializar um novo dataframe
+        :param metrica: 'obitos' ou 'casos'
+        :param limiar: o limiar, na unidade da métrica normalizada
+        :param normalizacao: normalizacao desejada (ver fator_normalizacao)
+        :return: Series com a data em que cada local atingiu o limiar (NaT se não atingiu), indexada por id_local
+            (ou, antes de separar_locais, por agrupar_full)
+        """
+        indice = self.indice_locais()
+        ordem, inicio, fim = indice['ordem'], indice['inicio'], indice['fim']
+
+        # série acumulada, monotônica dentro de cada local (correções para baixo nos dados são ignoradas)
+        coluna = metrica + 'Acumulado'
+        if coluna not in indice['acumulados']:
+            acum = pd.Series(self.covidbr[coluna].to_numpy(dtype=float, na_value=-np.inf)[ordem])
+            indice['acumulados'][coluna] = acum.groupby(indice['grupos'][ordem]).cummax().values
+        acum = indice['acumulados'][coluna]
+
+        # limiar absoluto de cada local
+        primeiras = self.juntar_locais(self.covidbr.iloc[ordem[inicio]])
+        f = self.fator_normalizacao(dados=primeiras, normalizacao=normalizacao)
+        limiar_local = limiar / pd.Series(f, index=primeiras.index).to_numpy(dtype=float, na_value=np.nan)
+
+        # busca binária no intervalo [lo, hi) de cada local
+        lo, hi = inicio.copy(), fim.copy()
+        ativo = lo < hi
+        while ativo.any():
+            meio = (lo + hi) // 2
+            atingiu = np.zeros(len(lo), dtype=bool)
+            atingiu[ativo] = acum[meio[ativo]] >= limiar_local[ativo]
+
+            hi = np.where(ativo & atingiu, meio, hi)
+            lo = np.where(ativo & ~atingiu, meio + 1, lo)
+            ativo = lo < hi
+
+        atingiu = lo < fim
+        datas = np.full(len(lo), np.datetime64('NaT'), dtype='datetime64[ns]')
+        datas[atingiu] = self.covidbr['data'].values[ordem[lo[atingiu]]]
+
+        if 'id_local' in primeiras.columns:
+            chaves = pd.Index(primeiras['id_local'].values, name='id_local')
+        else:
+            chaves = pd.MultiIndex.from_frame(primeiras[self.agrupar_full])
+
+        return pd.Series(
+            pd.DatetimeIndex(datas).tz_localize('UTC').tz_convert(self.covidbr['data'].dt.tz),
+            index=chaves,
+            name='data_limiar'
         )
 
+    def dias_desde_limiar(self, dados=None, metrica='obitos', limiar=limiar_obito_MMhab,
+                          normalizacao=('percapita',)):
+        """
+        dias desde que cada local atingiu um limiar (ver limiar_locais), calculado no momento da consulta
+        :param dados: linhas de covidbr para as quais calcular os dias. Se None, todas as linhas de covidbr
+        :param metrica: 'obitos' ou 'casos'
+        :param limiar: o limiar, na unidade da métrica normalizada
+        :param normalizacao: normalizacao desejada (ver fator_normalizacao)
+        :return: Series alinhada a dados com o número de dias (NaN antes do limiar ou se o local não o atingiu)
+        """
+        if dados is None:
+            dados = self.covidbr
+
+        indice = self.indice_locais()
+        datas_limiar = self.limiar_locais(metrica=metrica, limiar=limiar, normalizacao=normalizacao)
+
+        pos = self.covidbr.index.get_indexer(dados.index)
+        if (pos < 0).any():
+            raise KeyError('linhas que não estão em covidbr: {}'.format(list(dados.index[pos < 0][:10])))
+        grupos = indice['grupos'][pos]
+
+        ref = datas_limiar.dt.tz_convert('UTC').dt.tz_localize(None).values[grupos]
+        ref[grupos < 0] = np.datetime64('NaT')
+
+        dias = np.floor((self.covidbr['data'].values[pos] - ref) / np.timedelta64(1, 'D'))
+        dias[dias < 0] = np.nan
+
+        return pd.Series(dias, index=dados.index, name='dias_desde_limiar')
+
+    def populacao_por(self, escala):
+        """
+        população de cada linha de covidbr em unidades de 'escala' habitantes (ex.: 10**6 para MM hab.)
+        a população é constante em cada local: a divisão é feita uma vez por local e propagada às linhas
+        :param escala: número de habitantes por unidade
+        :return: array float (NaN onde não há população)
+        """
+        codigos, valores = pd.factorize(self.covidbr['populacaoTCU2019'])
+        por_local = np.append(np.asarray(valores, dtype=float) / escala, np.nan)
+
+        return por_local[codigos]
+
     def __norm_casos_obitos_percapita(self):
         """
         calcula o fator de normalização para considerar casos e óbitos por milhão de habitantes
@@ -591,7 +1866,7 @@ class covid_brasil:
         :return: None
         """
 
-        self.covidbr['norm_percapita'] = 1 / (self.covidbr['populacaoTCU2019'] / (10**6))
+        self.covidbr['norm_percapita'] = (1 / self.populacao_por(10**6)).astype(tipo_derivadas)
 
     def __norm_densidade_demografica(self):
         """
@@ -601,8 +1876,7 @@ class covid_brasil:
 
         :return: None
         """
-        self.covidbr['norm_densidade'] = self.covidbr['area'] / \
-                                         (self.covidbr['populacaoTCU2019']/1000)
+        self.covidbr['norm_densidade'] = (self.covidbr['area'] / self.populacao_por(1000)).astype(tipo_derivadas)
 
     def __norm_perfil_demografico(self):
         """
@@ -612,7 +1886,7 @@ class covid_brasil:
         :return: None
         """
 
-        self.covidbr['norm_demo'] = 1 / self.covidbr['pct_velhos']
+        self.covidbr['norm_demo'] = (1 / self.covidbr['pct_velhos']).astype(tipo_derivadas)
 
     def __norm_conectividade(self):
         """
@@ -623,21 +1897,18 @@ class covid_brasil:
 
         pass
 
-    def normalizacao(self):
+    def normalizacao(self, saidas=None):
         """
         calcular fatores de normalização
-            - normalização per capita
-            - TODO: normalização por densidade populacional
-            - TODO: normalização por % velhos na população
-            - TODO: normalização por conectividade
+            - normalização per capita (norm_percapita)
+            - normalização por densidade demográfica (norm_densidade)
+            - normalização por % velhos na população (norm_demo)
 
+        rodar as etapas da fase 'norm' do grafo de etapas (ver etapas)
+        :param saidas: saídas desejadas (ex.: ['covidbr.norm_percapita']). Se None, todas
         :return: None
         """
-        func_norm = [v for k, v in self.__class__.__dict__.items()
-                        if k.startswith('_covid_brasil__norm')]  # mangling
-
-        for f in func_norm:
-            _ = f(self)
+        self.executar_etapas('norm', saidas=saidas)
 
     def fator_normalizacao(self, dados, normalizacao):
         """
@@ -707,7 +1978,7 @@ class covid_brasil:
 
     def norm_grafico(self, dados, normalizacao,
                      x_orig=None, y_orig=None, titulo_x_orig=None, titulo_y_orig=None,
-                     norm_xy='y', crlf='\n', plotly=False):
+                     norm_xy='y', crlf='\n', plotly=False, chaves=None, manter=('local',)):
         """
         retorna alguns parametros necessarios para plotagem dos graficos com dados normalizados
 
@@ -716,11 +1987,14 @@ class covid_brasil:
         :param titulo_x_orig: o título do eixo x original
         :param titulo_y_orig: o título do eixo y original
         :param norm_xy: os eixos em que se deseja aplicar a normalizacao. Pode ser 'x', 'y' ou 'xy'
+        :param chaves: (plotly) as séries desejadas, ex.: ['x_ott7', 'y_ott7'] (ver chaves_plotly).
+            Se None, todas as séries são calculadas e anexadas a uma cópia de dados
+        :param manter: (plotly, com chaves) colunas de dados que acompanham as séries calculadas
         :return: vetor com
-            dados_normalizados: dataframe (cópia) contendo valores originais e valores normalizados
+            dados_normalizados: dataframe (cópia) contendo valores originais e valores normalizados.
+                No plotly com chaves, só as colunas em manter e as séries pedidas
             titulo_x, titulo_y: os valores dos titulos dos eixos após explicação da normalizacao
         """
-        dados = dados.copy()
 
         # calcular o fator de normalizacao
         f = self.fator_normalizacao(dados=dados, normalizacao=normalizacao)
@@ -730,6 +2004,8 @@ class covid_brasil:
 
         # aplicar o fator de normalizacao a cada eixo, caso apropriado
         if not plotly:
+            dados = dados.copy()
+
             dados['x'] = dados[x_orig]
             titulo_x = titulo_x_orig
             if 'x' in norm_xy:
@@ -744,122 +2020,30 @@ class covid_brasil:
 
             return dados, titulo_x, titulo_y
         else:
-            titulo_orig = dict()
-
-            tipo_graf_all = [
-                ['obitos', 'casos'],
-                ['total', 'novos'],
-                ['temporal', 'atemporal']
-            ]
-            
-            texto_mm = { mm: 'média móvel de ' + str(mm) + ' dias' for mm in [0, 3, 5, 7] }
-            texto_mm[0] = ''
-
-            for axis in ['x', 'y']:
-                combinations = list(pd.MultiIndex.from_product(tipo_graf_all))
-                if axis == 'x':
-                    key = { k: v for k, v in zip(
-                        combinations,
-                        [
-                            'dias_desde_obito_MMhab', 'obitosAcumulado', 'dias_desde_obito_MMhab', 'obitosAcumulado',
-                            'dias_desde_obito_MMhab', 'casosAcumulado', 'dias_desde_obito_MMhab', 'casosAcumulado'
-                        ]
-                    ) }
-                else:
-                    key = { k: v for k, v in zip(
-                        combinations,
-                        [
-                            'obitosAcumulado', 'obitos_7d', 'obitos_7d', 'obitos_7d',
-                            'casosAcumulado', 'casos_7d', 'casos_7d', 'casos_7d'
-                        ]
-                    ) }
-
-                for comb in combinations:
-                    for mm in texto_mm.keys():
-                        mm_str = str(mm)
-                        str_key = axis + '_'
-                        for c in comb:
-                            str_key += c[0]
-                            
-                        str_key += mm_str
-    
-                        # se o eixo x for temporal, não faz sentido fazer média movel
-                        if str_key[:-1].endswith('t') and str_key.startswith('x'):
-                            dados[str_key] = dados[key[comb]]
-                        else:
-                            dados[str_key] = dados[key[comb] + '_mm' + mm_str]
-    
-                        # titulos do eixo x
-                        if axis == 'x':
-
-                            # se eixo x for temporal, só existe uma possibilidade: dias desde o começo da pandemia
-                            if str_key[:-1].endswith('t'):
-                                titulo_orig[str_key] = 'Dias desde 0.1 óbitos / MM hab.'
-    
-                            # se eixo x for atemporal, há duas possibilidades: total de óbitos ou total de casos
-                            elif 'o' in str_key:
-                                titulo_orig[str_key] = 'Total de óbitos'
-                                if texto_mm[mm] != '':
-                                    titulo_orig[str_key] = titulo_orig[str_key] + ' (' + texto_mm[mm] + ')'
-    
-                            # caso eixo x seja atemporal mas não seja óbitos, então é total de casos
-                            else:
-                                titulo_orig[str_key] = 'Total de casos'
-                                if texto_mm[mm] != '':
-                                    titulo_orig[str_key] = titulo_orig[str_key] + ' (' + texto_mm[mm] + ')'
-    
-                        else:
-                            # há seis possibilidades para o eixo y.
-                            # se gráfico for atemporal, só há duas possibilidades, novos casos ou novos óbitos
-                            if 'a' in str_key:
-                                if 'o' in str_key:
-                                    titulo_orig[str_key] = 'Novos óbitos (últ. 7 dias)'
-                                    if texto_mm[mm] != '':
-                                        titulo_orig[str_key] = titulo_orig[str_key][:-1] + ', ' + texto_mm[mm] + ')'
-                                else:
-                                    titulo_orig[str_key] = 'Novos casos (últ. 7 dias)'
-                                    if texto_mm[mm] != '':
-                                        titulo_orig[str_key] = titulo_orig[str_key][:-1] + ', ' + texto_mm[mm] + ')'
-    
-                            # se o gráfico for temporal, então há quatro possibilidades para o eixo y
-                            else:
-                                # novos óbitos
-                                if 'o' in str_key:
-                                    if 'n' in str_key:
-                                        titulo_orig[str_key] = 'Novos óbitos (últ. 7 dias)'
-                                        if texto_mm[mm] != '':
-                                            titulo_orig[str_key] = titulo_orig[str_key][:-1] + ', ' + texto_mm[mm] + ')'
-                                            
-                                    # total de óbitos
-                                    else:
-                                        titulo_orig[str_key] = 'Total de Óbitos'
-                                        if texto_mm[mm] != '':
-                                            titulo_orig[str_key] = titulo_orig[str_key] + ' (' + texto_mm[mm] + ')'
-    
-                                else:
-                                    # novos casos
-                                    if 'n' in str_key:
-                                        titulo_orig[str_key] = 'Novos casos (últ. 7 dias)'
-                                        if texto_mm[mm] != '':
-                                            titulo_orig[str_key] = titulo_orig[str_key][:-1] + ', ' + texto_mm[mm] + ')'
-    
-                                    # total de casos
-                                    else:
-                                        titulo_orig[str_key] = 'Total de casos'
-                                        if texto_mm[mm] != '':
-                                            titulo_orig[str_key] = titulo_orig[str_key] + ' (' + texto_mm[mm] + ')'
-
-            titulo = titulo_orig.copy()
-            for k, v in titulo.items():
+            # só as séries pedidas são calculadas; os títulos originais vêm de chaves_plotly
+            series = dict()
+            titulo = dict()
+
+            for k in (chaves_plotly.keys() if chaves is None else chaves):
+                coluna, titulo[k] = chaves_plotly[k]
+                series[k] = dados[coluna]
+
                 if k[0] in norm_xy:
-                    dados[k] *= f
+                    series[k] = series[k] * f
                     titulo[k] += f_titulo
 
+            if chaves is None:
+                dados = pd.concat([dados, pd.DataFrame(series, index=dados.index)], axis=1)
+            else:
+                dados = pd.DataFrame(dict({ c: dados[c] for c in manter }, **series), index=dados.index)
+
             return dados, titulo, titulo
 
+    @instrumentada('covidbr')
     def suavizacao(self):
         """
         suavização via média móvel com período definido anteriormente
+        (a medição inclui dias_desde_obito_percapita, chamada ao final)
         :return: None
         """
 
@@ -867,40 +2051,49 @@ class covid_brasil:
                         'casosAcumulado', 'casos_7d',
                         'casosNovo', 'obitosNovo'
                       ]
-        for janela_mm in [ 0, 3, 5, 7]:
-            
-            mm_aplicado = [mm + '_mm' + str(janela_mm) for mm in mm_aplicar]
-            
-            if janela_mm != 0:
-                
-                df = self.covidbr.groupby(self.agrupar_full)[mm_aplicar].\
-                    rolling(janela_mm).mean()
-                df = df.set_index(df.index.get_level_values(None))
-                df.columns = mm_aplicado
-                
-                self.covidbr = pd.concat([self.covidbr, df], axis=1)
-                
-            else:
-                self.covidbr[mm_aplicado] = self.covidbr[mm_aplicar]
+
+        # ordenar uma única vez por local e data, e calcular todas as janelas de uma só vez
+        grupos, ordem = self.ordem_locais()
+
+        valores = self.covidbr[mm_aplicar].to_numpy(dtype=float, na_value=np.nan)
+        janelas = [ janela_mm for janela_mm in mm_janelas if janela_mm != 0 ]
+        somas = somas_moveis_agrupadas(valores[ordem], grupos[ordem], janelas)
+
+        # colunas pré-alocadas, na ordem original das linhas
+        mm_aplicado = []
+        resultado = np.empty((len(self.covidbr), len(mm_aplicar) * len(janelas)), dtype=tipo_derivadas)
+
+        for i, janela_mm in enumerate(janelas):
+            resultado[ordem, i * len(mm_aplicar):(i + 1) * len(mm_aplicar)] = somas[janela_mm] / janela_mm
+            mm_aplicado += [mm + '_mm' + str(janela_mm) for mm in mm_aplicar]
+
+        # janela 0: sem suavização
+        if 0 in mm_janelas:
+            for mm in mm_aplicar:
+                self.covidbr[mm + '_mm0'] = self.covidbr[mm]
+
+        self.covidbr = pd.concat(
+            [self.covidbr, pd.DataFrame(resultado, index=self.covidbr.index, columns=mm_aplicado)],
+            axis=1
+        )
 
         self.dias_desde_obito_percapita()
 
+    @instrumentada('covidrel')
     def dias_desde_obito_percapita(self):
         """
         cálculo de # de dias desde 0.1 obito por MM hab
         :return: None
         """
-        self.mask_obitoMMhab = self.covidbr['obitosAcumulado'] * self.covidbr['norm_percapita'] >= 0.1
+        self.mask_obitoMMhab = self.covidbr['obitosAcumulado'] * self.covidbr['norm_percapita'] >= limiar_obito_MMhab
 
-        self.covidrel = self.covidbr.loc[self.covidbr[self.mask_obitoMMhab].index]
+        self.covidrel = self.covidbr[self.mask_obitoMMhab].copy()
 
-        self.covidrel['dias_desde_obito_MMhab'] = self.covidrel.groupby(self.agrupar_full)['data'].apply(
-            lambda x: x - x.iloc[0]
-        )
+        # dias desde a primeira linha de cada local, em números inteiros de dias
+        datas = pd.Series(self.covidrel['data'].values, index=self.covidrel.index)
+        inicio = datas.groupby([self.covidrel[c] for c in self.agrupar_full], observed=True).transform('first')
 
-        self.covidrel['dias_desde_obito_MMhab'] = self.covidrel['dias_desde_obito_MMhab'].apply(
-            lambda x: x.days
-        ).astype(int)
+        self.covidrel['dias_desde_obito_MMhab'] = ((datas - inicio).values // np.timedelta64(1, 'D')).astype(int)
 
     def filtro_ultimos_n_dias(self, dias_atras=1, full=False):
         """
@@ -925,8 +2118,8 @@ class covid_brasil:
 
         :return: None
         """
-        self.covidbr['incidencia'] = self.covidbr['casosAcumulado'] / \
-        (self.covidbr['populacaoTCU2019'] / (10**5))
+        self.covidbr['incidencia'] = (self.covidbr['casosAcumulado'] / self.populacao_por(10**5)).\
+                                     astype(tipo_derivadas)
 
     def letalidade(self):
         """
@@ -934,7 +2127,8 @@ class covid_brasil:
 
         :return: None
         """
-        self.covidbr['letalidade'] = self.covidbr['obitosAcumulado'] / self.covidbr['casosAcumulado']
+        self.covidbr['letalidade'] = (self.covidbr['obitosAcumulado'] / self.covidbr['casosAcumulado']).\
+                                     astype(tipo_derivadas)
 
     def mortalidade(self):
         """
@@ -942,8 +2136,8 @@ class covid_brasil:
 
          :return: None
          """
-        self.covidbr['mortalidade'] = self.covidbr['obitosAcumulado'] / \
-                                     (self.covidbr['populacaoTCU2019'] / (10**5))
+        self.covidbr['mortalidade'] = (self.covidbr['obitosAcumulado'] / self.populacao_por(10**5)).\
+                                      astype(tipo_derivadas)
 
     def __graf_obitos_acum_por_novos_obitos_loglog_estados(self, data_estados, normalizacao):
         """
@@ -1320,8 +2514,10 @@ class covid_brasil:
         :return: None
         """
 
-        plt_data_estados = self.covidrel[(~self.mask_exc_resumo_rel) & self.covidrel['estado'].isin(estados)]
-        plt_data_municipios = self.covidrel[self.covidrel['municipio'].isin(municipios)]
+        covidrel = self.juntar_locais(self.covidrel)
+
+        plt_data_estados = covidrel[(~self.mask_exc_resumo_rel) & covidrel['estado'].isin(estados)]
+        plt_data_municipios = covidrel[covidrel['municipio'].isin(municipios)]
 
         # executar todas as funções no escopo atual começando por '__graf'
 
@@ -1340,6 +2536,346 @@ class covid_brasil:
             self.eixos += axs
 
 
+def montar_chaves_plotly():
+    """
+    monta as séries disponíveis nos gráficos do plotly. Cada série é identificada por uma chave
+        <eixo>_<óbitos/casos><total/novos><temporal/atemporal><janela da média móvel>, ex.: 'y_otn7'
+    :return: dicionário { chave: (coluna dos dados, título original do eixo) }
+    """
+    titulo_orig = dict()
+    colunas = dict()
+
+    tipo_graf_all = [
+        ['obitos', 'casos'],
+        ['total', 'novos'],
+        ['temporal', 'atemporal']
+    ]
+
+    texto_mm = { mm: 'média móvel de ' + str(mm) + ' dias' for mm in [0, 3, 5, 7] }
+    texto_mm[0] = ''
+
+    for axis in ['x', 'y']:
+        combinations = list(pd.MultiIndex.from_product(tipo_graf_all))
+        if axis == 'x':
+            key = { k: v for k, v in zip(
+                combinations,
+                [
+                    'dias_desde_obito_MMhab', 'obitosAcumulado', 'dias_desde_obito_MMhab', 'obitosAcumulado',
+                    'dias_desde_obito_MMhab', 'casosAcumulado', 'dias_desde_obito_MMhab', 'casosAcumulado'
+                ]
+            ) }
+        else:
+            key = { k: v for k, v in zip(
+                combinations,
+                [
+                    'obitosAcumulado', 'obitos_7d', 'obitos_7d', 'obitos_7d',
+                    'casosAcumulado', 'casos_7d', 'casos_7d', 'casos_7d'
+                ]
+            ) }
+
+        for comb in combinations:
+            for mm in texto_mm.keys():
+                mm_str = str(mm)
+                str_key = axis + '_'
+                for c in comb:
+                    str_key += c[0]
+
+                str_key += mm_str
+
+                # se o eixo x for temporal, não faz sentido fazer média movel
+                if str_key[:-1].endswith('t') and str_key.startswith('x'):
+                    colunas[str_key] = key[comb]
+                else:
+                    colunas[str_key] = key[comb] + '_mm' + mm_str
+
+                # titulos do eixo x
+                if axis == 'x':
+
+                    # se eixo x for temporal, só existe uma possibilidade: dias desde o começo da pandemia
+                    if str_key[:-1].endswith('t'):
+                        titulo_orig[str_key] = 'Dias desde 0.1 óbitos / MM hab.'
+
+                    # se eixo x for atemporal, há duas possibilidades: total de óbitos ou total de casos
+                    elif 'o' in str_key:
+                        titulo_orig[str_key] = 'Total de óbitos'
+                        if texto_mm[mm] != '':
+                            titulo_orig[str_key] = titulo_orig[str_key] + ' (' + texto_mm[mm] + ')'
+
+                    # caso eixo x seja atemporal mas não seja óbitos, então é total de casos
+                    else:
+                        titulo_orig[str_key] = 'Total de casos'
+                        if texto_mm[mm] != '':
+                            titulo_orig[str_key] = titulo_orig[str_key] + ' (' + texto_mm[mm] + ')'
+
+                else:
+                    # há seis possibilidades para o eixo y.
+                    # se gráfico for atemporal, só há duas possibilidades, novos casos ou novos óbitos
+                    if 'a' in str_key:
+                        if 'o' in str_key:
+                            titulo_orig[str_key] = 'Novos óbitos (últ. 7 dias)'
+                            if texto_mm[mm] != '':
+                                titulo_orig[str_key] = titulo_orig[str_key][:-1] + ', ' + texto_mm[mm] + ')'
+                        else:
+                            titulo_orig[str_key] = 'Novos casos (últ. 7 dias)'
+                            if texto_mm[mm] != '':
+                                titulo_orig[str_key] = titulo_orig[str_key][:-1] + ', ' + texto_mm[mm] + ')'
+
+                    # se o gráfico for temporal, então há quatro possibilidades para o eixo y
+                    else:
+                        # novos óbitos
+                        if 'o' in str_key:
+                            if 'n' in str_key:
+                                titulo_orig[str_key] = 'Novos óbitos (últ. 7 dias)'
+                                if texto_mm[mm] != '':
+                                    titulo_orig[str_key] = titulo_orig[str_key][:-1] + ', ' + texto_mm[mm] + ')'
+
+                            # total de óbitos
+                            else:
+                                titulo_orig[str_key] = 'Total de Óbitos'
+                                if texto_mm[mm] != '':
+                                    titulo_orig[str_key] = titulo_orig[str_key] + ' (' + texto_mm[mm] + ')'
+
+                        else:
+                            # novos casos
+                            if 'n' in str_key:
+                                titulo_orig[str_key] = 'Novos casos (últ. 7 dias)'
+                                if texto_mm[mm] != '':
+                                    titulo_orig[str_key] = titulo_orig[str_key][:-1] + ', ' + texto_mm[mm] + ')'
+
+                            # total de casos
+                            else:
+                                titulo_orig[str_key] = 'Total de casos'
+                                if texto_mm[mm] != '':
+                                    titulo_orig[str_key] = titulo_orig[str_key] + ' (' + texto_mm[mm] + ')'
+
+    return { k: (colunas[k], titulo_orig[k]) for k in colunas }
+
+# calculado uma única vez e reaproveitado por covid_brasil.norm_grafico
+chaves_plotly = montar_chaves_plotly()
+
+def etapas_necessarias(fase, saidas=None):
+    """
+    etapas de uma fase do grafo (ver etapas) necessárias para produzir as saídas desejadas
+    (saídas produzidas por outras fases são consideradas prontas)
+    :param fase: 'preproc' ou 'norm'
+    :param saidas: lista de saídas. Se None, todas as etapas da fase
+    :return: lista de etapas, na ordem do grafo
+    """
+    na_fase = [ etapa for etapa, info in etapas.items() if info['fase'] == fase ]
+    if saidas is None:
+        return na_fase
+
+    produtor = { saida: etapa for etapa in na_fase for saida in etapas[etapa]['saidas'] }
+
+    necessarias = set()
+    faltantes = list(saidas)
+    while len(faltantes) > 0:
+        etapa = produtor.get(faltantes.pop())
+        if etapa is None or etapa in necessarias:
+            continue
+
+        necessarias.add(etapa)
+        faltantes += etapas[etapa]['entradas']
+
+    return [ etapa for etapa in na_fase if etapa in necessarias ]
+
+
+def tipos_contagens(df, colunas, tipo=None):
+    """
+    tipos das colunas de contagens segundo a política de tipos (ver tipo_contagens):
+    inteiro do numpy se a coluna não tiver nulos, inteiro mascarado do pandas caso contrário
+    :param df: DataFrame
+    :param colunas: colunas de contagens (as que não estiverem em df são ignoradas)
+    :param tipo: 'int64' ou 'int32'. Se None, tipo_contagens
+    :return: dicionário { coluna: tipo }, para DataFrame.astype
+    """
+    if tipo is None:
+        tipo = tipo_contagens
+
+    return { c: (tipo if df[c].notnull().all() else tipo.capitalize()) for c in colunas if c in df.columns }
+
+
+def tipo_mais_barato(serie, limiar_categoria=limiar_categoria, tolerancia=tolerancia_float32):
+    """
+    tipo mais barato que representa os valores de uma Series sem perda (ou, para reais, com erro relativo
+    de no máximo tolerancia):
+        - inteiros, e reais com valores inteiros: o menor inteiro que comporta mínimo e máximo
+          (mascarado do pandas, ex.: 'Int16', se houver nulos)
+        - reais: 'float32'
+        - texto: 'category', se houver poucos valores distintos (ver limiar_categoria)
+    :param serie: Series
+    :param limiar_categoria: máximo de valores distintos por linha para sugerir 'category'
+    :param tolerancia: erro relativo máximo para sugerir 'float32'
+    :return: o tipo sugerido (str), ou None se o tipo atual já for o mais barato
+    """
+    tipo = serie.dtype
+    valores = serie.dropna()
+
+    if len(valores) == 0 or pd.api.types.is_bool_dtype(tipo) or isinstance(tipo, pd.CategoricalDtype) or \
+            pd.api.types.is_datetime64_any_dtype(tipo):
+        return None
+
+    sugerido = None
+
+    if pd.api.types.is_numeric_dtype(tipo):
+        v = valores.to_numpy(dtype=float)
+        inteiros = pd.api.types.is_integer_dtype(tipo) or (np.isfinite(v).all() and (v == np.round(v)).all())
+
+        if inteiros:
+            for bits in [8, 16, 32, 64]:
+                limites = np.iinfo('int{}'.format(bits))
+                if limites.min <= v.min() and v.max() <= limites.max:
+                    break
+            sugerido = ('Int{}' if len(valores) < len(serie) else 'int{}').format(bits)
+
+        elif np.allclose(v.astype(np.float32), v, rtol=tolerancia, atol=0):
+            sugerido = 'float32'
+
+    elif pd.api.types.is_object_dtype(tipo) or pd.api.types.is_string_dtype(tipo):
+        if valores.nunique() <= limiar_categoria * len(serie):
+            sugerido = 'category'
+
+    return None if sugerido == str(tipo) else sugerido
+
+
+def renomear_por_tipo(serie, tipo_local, nomes):
+    """
+    substitui os valores de uma Series categórica conforme o tipo do local de cada linha, alterando só os códigos
+    :param serie: Series categórica
+    :param tipo_local: array com o tipo do local de cada linha (ver tipos_local)
+    :param nomes: dicionário { tipo: nome }. Linhas de outros tipos não são alteradas
+    :return: Series categórica
+    """
+    novas = [ n for n in pd.unique(list(nomes.values())) if n not in serie.cat.categories ]
+    serie = serie.cat.add_categories(novas)
+
+    # código substituto de cada tipo (-2: manter o código original)
+    substituto = np.full(max(tipos_local.values()) + 1, -2)
+    for tipo, nome in nomes.items():
+        substituto[tipo] = serie.cat.categories.get_loc(nome)
+
+    novo = substituto[tipo_local]
+    codigos = np.where(novo == -2, serie.cat.codes.to_numpy(), novo)
+
+    return pd.Series(pd.Categorical.from_codes(codigos, categories=serie.cat.categories),
+                     index=serie.index, name=serie.name)
+
+
+def montar_local(estado, municipio, tipo_local):
+    """
+    nome de exibição de cada local, como categórico:
+        'município, UF' para municípios, 'UF' para os resumos estaduais e 'Brasil' para o resumo brasileiro
+    o nome é montado uma vez por par (estado, municipio) distinto e propagado às linhas pelos códigos
+    :param estado: Series categórica com as siglas dos estados
+    :param municipio: Series categórica com os municípios
+    :param tipo_local: array com o tipo do local de cada linha (ver tipos_local)
+    :return: Series categórica
+    """
+    n_mun = len(municipio.cat.categories) + 1
+    par = (estado.cat.codes.to_numpy(dtype='int64') + 1) * n_mun + (municipio.cat.codes.to_numpy(dtype='int64') + 1)
+    pares, primeiras, linhas = np.unique(par, return_index=True, return_inverse=True)
+
+    est = pd.Series(pd.Categorical.from_codes(pares // n_mun - 1, estado.cat.categories)).astype('string')
+    mun = pd.Series(pd.Categorical.from_codes(pares % n_mun - 1, municipio.cat.categories)).astype('string')
+    tipo = np.asarray(tipo_local)[primeiras]
+
+    local = mun + ', ' + est
+    local = local.mask(tipo == tipos_local['resumo_estado'], est)
+    local = local.mask(tipo == tipos_local['brasil'], 'Brasil')
+
+    codigos, nomes = pd.factorize(local)
+
+    return pd.Series(pd.Categorical.from_codes(codigos[linhas], categories=np.asarray(nomes, dtype=object)),
+                     index=estado.index, name='local')
+
+
+def somas_moveis_agrupadas(valores, grupos, janelas):
+    """
+    somas móveis (equivalentes a rolling(janela).sum() dentro de cada grupo) para várias janelas de uma só vez,
+    sem chamadas Python por grupo: calcula-se uma soma acumulada e cada janela é uma diferença entre duas posições
+    dela, desde que a janela não ultrapasse o início do grupo
+    :param valores: array (n,) ou (n, k), ordenado por grupo e, dentro de cada grupo, por data
+    :param grupos: array (n,) com o código inteiro do grupo de cada linha (linhas do mesmo grupo contíguas).
+        códigos negativos (chaves nulas no groupby) resultam em NaN
+    :param janelas: lista com os tamanhos das janelas
+    :return: dicionário { janela: array float com as somas }. NaN onde a janela estiver incompleta ou contiver NaN
+    """
+    valores = np.asarray(valores, dtype=float)
+    unidim = valores.ndim == 1
+    if unidim:
+        valores = valores[:, None]
+
+    n = len(valores)
+    pos = np.arange(n)
+
+    validos = ~np.isnan(valores)
+    zerados = np.where(validos, valores, 0)
+
+    # contagens (valores inteiros): soma acumulada em inteiros, exata. Reais: em float, e as diferenças da
+    # ordem do erro de arredondamento da soma acumulada (cancelamento) são zeradas abaixo
+    inteiros = np.array_equal(zerados, np.round(zerados)) and np.abs(zerados).sum() < 2 ** 62
+    acum = np.zeros((n + 1, valores.shape[1]), dtype=np.int64 if inteiros else float)
+    np.cumsum(zerados.astype(acum.dtype), axis=0, out=acum[1:])
+    acum_validos = np.zeros((n + 1, valores.shape[1]), dtype=np.int64)
+    np.cumsum(validos, axis=0, out=acum_validos[1:])
+
+    # posição da primeira linha do grupo de cada linha
+    grupos = np.asarray(grupos)
+    novo_grupo = np.ones(n, dtype=bool)
+    novo_grupo[1:] = grupos[1:] != grupos[:-1]
+    inicio_grupo = np.maximum.accumulate(np.where(novo_grupo, pos, 0))
+
+    somas = {}
+    for janela in janelas:
+        inicio = pos - janela + 1
+        completa = (inicio >= inicio_grupo) & (grupos >= 0)
+        inicio = np.maximum(inicio, 0)
+
+        soma = (acum[pos + 1] - acum[inicio]).astype(float)
+        if not inteiros:
+            # cada uma das 'janela' parcelas da diferença erra no máximo ~eps * |soma acumulada|
+            residuo = 4 * janela * np.finfo(float).eps * np.maximum(np.abs(acum[pos + 1]), np.abs(acum[inicio]))
+            soma[np.abs(soma) <= residuo] = 0.
+
+        soma[~(completa[:, None] & (acum_validos[pos + 1] - acum_validos[inicio] == janela))] = np.nan
+
+        somas[janela] = soma[:, 0] if unidim else soma
+
+    return somas
+
+def indice_denso(codigos):
+    """
+    índice denso de uma tabela indexada por códigos inteiros não negativos (coduf, codmun):
+    um array em que a posição 'código' guarda a linha da tabela com esse código (-1 se não houver)
+    :param codigos: códigos de cada linha da tabela
+    :return: array de linhas, de tamanho max(codigos) + 1
+    """
+    codigos = pd.Series(codigos).to_numpy(dtype='int64', na_value=-1)
+    linhas = np.arange(len(codigos))[codigos >= 0]
+    codigos = codigos[codigos >= 0]
+
+    indice = np.full(codigos.max() + 1 if len(codigos) > 0 else 0, -1, dtype='int64')
+    indice[codigos] = linhas
+
+    return indice
+
+
+def buscar_denso(indice, codigos):
+    """
+    linhas da tabela (ver indice_denso) correspondentes a cada código procurado
+    :param indice: índice denso da tabela
+    :param codigos: códigos procurados (nulos ou fora da tabela não são encontrados)
+    :return: array de linhas (-1 onde o código não foi encontrado)
+    """
+    codigos = pd.Series(codigos).to_numpy(dtype='int64', na_value=-1)
+    validos = (codigos >= 0) & (codigos < len(indice))
+
+    linhas = np.full(len(codigos), -1, dtype='int64')
+    linhas[validos] = indice[codigos[validos]]
+
+    return linhas
+
+
 def dumbcache_load(cache_dir=r'data\cache'):
     """
     carrega os dados salvos via pickle na pasta cache, no arquivo br_store.dmp
@@ -1349,8 +2885,45 @@ def dumbcache_load(cache_dir=r'data\cache'):
     with open(DUMBCACHE, 'rb') as f:
         return pkl.load(f)
 
+def snapshot_atual(cache_dir=r'data\cache\snapshot'):
+    """
+    subdiretório do snapshot atual (ver covid_brasil.snapshot_dump)
+    :param cache_dir: pasta do snapshot, relativa ao diretório raiz
+    :return: nome do subdiretório
+    """
+    with open(os.path.join(r'..', cache_dir, snapshot_ponteiro), 'r', encoding='utf-8') as f:
+        return f.read().strip()
+
+def snapshot_load(cache_dir=r'data\cache\snapshot'):
+    """
+    carrega os dados salvos via covid_brasil.snapshot_dump
+    só o manifesto é lido aqui; cada tabela é lida (e mapeada em memória) no primeiro acesso, sempre do
+    subdiretório do snapshot que era o atual no carregamento, mesmo que um snapshot novo seja salvo depois.
+    vários processos (ex.: workers do dashboard) podem carregar o mesmo snapshot: consultas feitas via
+    covid_brasil.series_rel e covid_brasil.colunas leem direto dos arquivos mapeados, compartilhados entre eles
+    :param cache_dir: pasta do snapshot, relativa ao diretório raiz
+    :return: instancia da classe covid_brasil
+    """
+    SNAPSHOT_DIR = os.path.join(r'..', cache_dir, snapshot_atual(cache_dir))
+    with open(os.path.join(SNAPSHOT_DIR, snapshot_manifesto), 'r', encoding='utf-8') as f:
+        manifesto = json.load(f)
+
+    if manifesto.get('versao') != snapshot_versao:
+        raise ValueError('versão do snapshot incompatível: {}'.format(manifesto.get('versao')))
+
+    # criar a instância sem passar pelo __init__ (que leria e processaria os dados)
+    br = covid_brasil.__new__(covid_brasil)
+    br._snapshot_dir = SNAPSHOT_DIR
+    br._snapshot = manifesto
+
+    for nome, valor in manifesto['atributos'].items():
+        setattr(br, nome, valor)
+
+    return br
+
 if __name__ == '__main__':
     br = covid_brasil(diretorio = None, graficos = False)
 
-    cbr = br.covidrel[~br.mask_exc_resumo_rel].groupby(['regiao', 'estado', 'data']).last()
+    crel = br.juntar_locais(br.covidrel)
+    cbr = crel[~br.mask_exc_resumo_rel].groupby(['regiao', 'estado', 'data'], observed=True).last()
     cbr = cbr.drop(columns=['municipio', 'codmun'])
\ No newline at end of file
@@ -0,0 +1,42 @@
+// callbacks do Dash executados no navegador: só alteram a apresentação, sem acionar o servidor
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    covid: {
+        // aplicar a escala dos eixos à figura calculada no servidor
+        escala: function(figura, xlog, ylog) {
+            if (!figura) {
+                return window.dash_clientside.no_update;
+            }
+
+            var layout = Object.assign({}, figura.layout);
+            layout.xaxis = Object.assign({}, layout.xaxis, {type: xlog});
+            layout.yaxis = Object.assign({}, layout.yaxis, {type: ylog});
+
+            return Object.assign({}, figura, {layout: layout});
+        },
+
+        // selecionar escala do eixo x e eixos normalizados a depender das opções
+        escala_eixo: function(tempo_atempo, ylog, eixo_norm) {
+            var xlog;
+            var novo_norm;
+
+            if (tempo_atempo === 'tempo') {
+                xlog = 'linear';
+                novo_norm = eixo_norm.filter(function(e) { return e !== 'x'; });
+            } else {
+                xlog = ylog;
+                novo_norm = eixo_norm.slice();
+                if (novo_norm.indexOf('y') >= 0 && novo_norm.indexOf('x') < 0) {
+                    novo_norm.push('x');
+                }
+            }
+
+            // a normalização exige novos dados do servidor: só alterá-la se de fato mudar
+            if (novo_norm.length === eixo_norm.length) {
+                return [xlog, window.dash_clientside.no_update];
+            }
+
+            return [xlog, novo_norm];
+        }
+    }
+});
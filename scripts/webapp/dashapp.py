@@ -3,19 +3,23 @@
 
 #import numpy as np
 #import scipy.stats as spst
+import numpy as np
 import pandas as pd
 import os
 import os.path
 import datetime as dt
 import functools as ft
 import locale
+import collections
+import threading
+import time
 
 import plotly.graph_objs as go
 import plotly.express as px
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, ClientsideFunction
 
 from thesmuggler import smuggle
 
@@ -27,41 +31,132 @@ covid_brasil = covid.covid_brasil
 # ##
 mm_periodo = 5
 
+# tamanho máximo e validade (em segundos, None = sem validade) do cache de figuras
+cache_tamanho = 128
+cache_validade = None
+
+# pasta do snapshot (relativa ao diretório raiz, ver covid.snapshot_load) e intervalo mínimo, em segundos,
+# entre duas verificações de snapshot novo (ver covid_plot.verificar_snapshot)
+snapshot_dir = r'..\data\cache\snapshot'
+snapshot_verificacao = 5
+
+# seleções mais populares, calculadas na inicialização (argumentos de covid_plot.atualizar_grafico)
+cache_aquecimento = [
+    # Brasil e RJ, per capita, média móvel de 7 dias
+    dict(data_estados=[33, 76], data_municipios=[],
+         obitos_casos='obitos', total_novos='total', tempo_atempo='tempo', suavizacao=7,
+         normalizacao_pop='percapita', normalizacao_extra=[], norm_xy_list=['y']),
+    # seleção padrão do aplicativo
+    dict(data_estados=[33, 35, 76], data_municipios=[330330, 330445],
+         obitos_casos='obitos', total_novos='total', tempo_atempo='tempo', suavizacao=7,
+         normalizacao_pop='percapita', normalizacao_extra=[], norm_xy_list=['y']),
+]
+
+class cache_figuras:
+    """
+    cache LRU (com validade opcional) das figuras geradas pelos callbacks do Dash
+
+    o cache vive na memória do processo: sob o gunicorn com vários workers, cada worker tem o seu
+    (as figuras são calculadas e aquecidas uma vez por worker), e limpar e estatisticas só valem
+    para o worker que atendeu a requisição. Cada worker detecta sozinho um snapshot novo
+    (ver covid_plot.verificar_snapshot), e as chaves levam a versão dos dados (ver covid_plot.chave_cache)
+    """
+
+    def __init__(self, tamanho=cache_tamanho, validade=cache_validade):
+        self.tamanho = tamanho
+        self.validade = validade
+
+        self.dados = collections.OrderedDict()
+        self.trava = threading.Lock()
+
+        self.acertos = 0
+        self.falhas = 0
+
+    def obter(self, chave):
+        """
+        buscar um resultado no cache
+        :param chave: chave normalizada (ver covid_plot.chave_cache)
+        :return: o resultado guardado ou None
+        """
+        with self.trava:
+            item = self.dados.get(chave)
+
+            if item is not None and self.validade is not None and time.monotonic() - item[0] > self.validade:
+                del self.dados[chave]
+                item = None
+
+            if item is None:
+                self.falhas += 1
+                return None
+
+            self.acertos += 1
+            self.dados.move_to_end(chave)
+            return item[1]
+
+    def guardar(self, chave, valor):
+        """
+        guardar um resultado no cache, descartando o menos usado recentemente se necessário
+        :return: None
+        """
+        with self.trava:
+            self.dados[chave] = (time.monotonic(), valor)
+            self.dados.move_to_end(chave)
+
+            while len(self.dados) > self.tamanho:
+                self.dados.popitem(last=False)
+
+    def limpar(self):
+        """
+        esvaziar o cache (ex.: quando os dados são recarregados). Só o deste processo
+        :return: None
+        """
+        with self.trava:
+            self.dados.clear()
+
+    def estatisticas(self):
+        """
+        contadores de uso do cache, para dimensioná-lo. Só os deste processo (identificado por 'pid'):
+        com vários workers, cada requisição a /cache responde pelo worker que a atendeu
+        :return: dicionário
+        """
+        with self.trava:
+            total = self.acertos + self.falhas
+            return {
+                'pid': os.getpid(),
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+                'taxa_acertos': self.acertos / total if total > 0 else None,
+                'itens': len(self.dados),
+                'tamanho': self.tamanho,
+                'validade': self.validade
+            }
+
 class covid_plot:
     """ classe para plotagem da evolução da COVID-19 no Brasil e no mundo """
 
-    def __init__(self, br, world=None):
+    def __init__(self, br, world=None, aquecer=True, snapshot_dir=None):
         self.br = br # classe covid_brasil
         self.world = world # classe para representar o mundo (ainda não implementada)
 
-        self.estados_key, self.municipios_key = self.construir_indice()
-
-        # Brasil e RJ
-        data_estados = [76, 33]
+        # pasta do snapshot de onde br foi carregado: se None, os dados nunca são recarregados
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_verificado_em = time.monotonic()
+        self.snapshot_trava = threading.Lock()
 
-        # Brasil e Niterói, RJ
-        data_municipios = [ 760001, 330330 ]
-        normalizacao = ['percapita']
+        self.cache = cache_figuras()
 
-        x, y = self.selec_xy(obitos_casos = 'obitos',
-                             total_novos = 'total',
-                             tempo_atempo = 'tempo')
-
-        self.fig, self.df_norm, self.titulo = self.construir_figura(
-            data_estados, data_municipios, normalizacao, x, y
-        )
-        self.atualizar_figura(x, y)
-        self.salvar(html_fig = r'..\imgs (nogit)\img.html')
+        self.estados_key, self.municipios_key = self.construir_indice()
 
+        # nenhuma figura fica na instância, compartilhada por todas as sessões: a figura inicial é calculada
+        # pelo callback de 'figura_dados' no carregamento da página (ver atualizar_grafico)
         self.dash_builder = {}
         self.dashapp = self.dash_build(debug=True)
 
         # callbacks
+        # o servidor só é acionado quando a seleção dos dados muda. A figura calculada vai para 'figura_dados'
         self.dashapp.callback(
-            Output(component_id='covid', component_property='figure'),
-            [   Input(component_id='xlog', component_property='value'),
-                Input(component_id='ylog', component_property='value'),
-                Input(component_id='opcao_estado', component_property='value'),
+            Output(component_id='figura_dados', component_property='data'),
+            [   Input(component_id='opcao_estado', component_property='value'),
                 Input(component_id='opcao_municipio', component_property='value'),
                 Input(component_id='opcao_obitos_casos', component_property='value'),
                 Input(component_id='opcao_total_novos', component_property='value'),
@@ -70,25 +165,121 @@ class covid_plot:
                 Input(component_id='opcao_norm_pop', component_property='value'),
                 Input(component_id='opcao_norm_extra', component_property='value'),
                 Input(component_id='opcao_norm_xy', component_property='value')
-            ],[
-                State(component_id='covid', component_property='figure')
             ]
         )(self.atualizar_grafico)
-        self.dashapp.callback(
+
+        # escala dos eixos: só apresentação, resolvida no navegador (assets/clientside.js)
+        self.dashapp.clientside_callback(
+            ClientsideFunction(namespace='covid', function_name='escala'),
+            Output(component_id='covid', component_property='figure'),
+            [Input(component_id='figura_dados', component_property='data'),
+             Input(component_id='xlog', component_property='value'),
+             Input(component_id='ylog', component_property='value')]
+        )
+        self.dashapp.clientside_callback(
+            ClientsideFunction(namespace='covid', function_name='escala_eixo'),
             [Output(component_id='xlog', component_property='value'),
              Output(component_id='opcao_norm_xy', component_property='value')],
             [Input(component_id='opcao_eixox_tempo', component_property='value'),
              Input(component_id='ylog', component_property='value')],
             [State(component_id='opcao_norm_xy', component_property='value')]
-        )(self.escala_eixo)
+        )
+
+        # contadores do cache de figuras (do worker que atender a requisição; ver cache_figuras)
+        self.dashapp.server.route('/cache')(self.cache.estatisticas)
 
-    def construir_indice(self):
+        if aquecer:
+            self.aquecer_cache()
+
+    def recarregar(self, br):
+        """
+        trocar os dados (ex.: após um novo snapshot) e invalidar o cache de figuras
+        :param br: nova instância de covid_brasil
+        :return: None
+        """
+        estados_key, municipios_key = self.construir_indice(br)
+
+        self.br, self.estados_key, self.municipios_key = br, estados_key, municipios_key
+        self.cache.limpar()
+
+    def versao_dados(self):
+        """
+        versão dos dados em uso: o identificador do snapshot de onde vieram (None se não vieram de um snapshot)
+        :return: str ou None
+        """
+        return self.br.__dict__.get('_snapshot', {}).get('id')
+
+    def verificar_snapshot(self, forcar=False):
+        """
+        recarregar os dados se houver um snapshot novo (ver covid.snapshot_atual).
+        o ponteiro do snapshot é lido no máximo uma vez a cada snapshot_verificacao segundos
+        :param forcar: se True, verifica mesmo antes do intervalo
+        :return: True se os dados foram recarregados
+        """
+        if self.snapshot_dir is None:
+            return False
+
+        agora = time.monotonic()
+        if not forcar and agora - self.snapshot_verificado_em < snapshot_verificacao:
+            return False
+
+        # uma thread verifica (e recarrega) de cada vez; as demais seguem com os dados atuais
+        if not self.snapshot_trava.acquire(blocking=False):
+            return False
+
+        try:
+            self.snapshot_verificado_em = agora
+            if covid.snapshot_atual(cache_dir=self.snapshot_dir) == self.versao_dados():
+                return False
+
+            self.recarregar(covid.snapshot_load(cache_dir=self.snapshot_dir))
+            return True
+        finally:
+            self.snapshot_trava.release()
+
+    def aquecer_cache(self, selecoes=None):
+        """
+        calcular de antemão as figuras das seleções mais populares
+        :param selecoes: lista de dicionários com os argumentos de atualizar_grafico. Se None, cache_aquecimento
+        :return: None
+        """
+        if selecoes is None:
+            selecoes = cache_aquecimento
+
+        for selecao in selecoes:
+            self.atualizar_grafico(**selecao)
+
+    def chave_cache(self, data_estados, data_municipios,
+                    obitos_casos, total_novos, tempo_atempo,
+                    suavizacao,
+                    normalizacao_pop, normalizacao_extra, norm_xy_list):
+        """
+        chave normalizada das opções do gráfico: a ordem das listas não altera a figura.
+        inclui a versão dos dados, de forma que figuras de um snapshot anterior nunca são servidas
+        :return: tupla
+        """
+        return (self.versao_dados(),
+                tuple(sorted(data_estados or [])), tuple(sorted(data_municipios or [])),
+                obitos_casos, total_novos, tempo_atempo,
+                suavizacao,
+                normalizacao_pop, tuple(sorted(normalizacao_extra or [])), tuple(sorted(norm_xy_list or [])))
+
+    def construir_indice(self, br=None):
         """
         Construir índice de estados e municípios
+        :param br: instância de covid_brasil. Se None, self.br
         :return: índice de estados e munícipios
         """
+        if br is None:
+            br = self.br
+
         # construindo referencia de coduf e codmun
-        df_exc = br.covidrel[br.mask_exc_resumo_rel]
+        # só os locais presentes em covidrel (sem Brasil e resumos), lidos da tabela de locais e do índice
+        # de covidrel (indexado por codmun fora dos resumos): nenhuma coluna de covidrel é lida do snapshot
+        locais = br.locais
+        codmun = locais['codmun'].to_numpy(dtype='int64', na_value=-1)
+        df_exc = locais[~locais['tipo_local'].isin(covid.tipos_resumo).values &
+                        np.isin(codmun, br.indice_rel.index.values)]
         estados_key = df_exc.groupby('coduf')['estado'].first()
         municipios_key = df_exc.groupby('codmun')['local'].first()
 
@@ -115,78 +306,84 @@ class covid_plot:
         """
         
         br = self.br
-        crel = br.covidrel.copy()
-        df_est = crel[(~br.mask_exc_resumo_rel) & (crel['coduf'].isin(data_estados))]
-        df_mun = crel[(br.mask_exc_resumo_rel) & (crel['codmun'].isin(data_municipios))]
-        df = pd.concat([df_est, df_mun])
 
+        # só as séries selecionadas, via índice de covidrel por local
+        df = br.series_rel(estados=data_estados, municipios=data_municipios)
+
+        x_s = x + str(suavizacao)
+        y_s = y + str(suavizacao)
+
+        # só as séries x_s e y_s são calculadas
         df_norm, titulo, _ = br.norm_grafico(
             dados=df,
             normalizacao=normalizacao,
-            norm_xy=norm_xy, crlf='<br>', plotly=True
+            norm_xy=norm_xy, crlf='<br>', plotly=True,
+            chaves=[x_s, y_s]
         )
         
-        x_s = x + str(suavizacao)
-        y_s = y + str(suavizacao)
-        
         fig1 = px.line(df_norm, x=x_s, y=y_s, color='local', log_y=True, hover_name='local')
 
         fig = fig1
 
         return fig, df_norm, titulo
 
-    def atualizar_figura(self, x, y, xlog='linear', ylog='log', suavizacao=7,
+    def atualizar_figura(self, fig, titulo, x, y, xlog='linear', ylog='log', suavizacao=7,
                          obitos_casos='obitos', tempo_atempo = 'tempo',
                          normalizacao_pop='densidade_demografica',
                          data_estados=[33], data_municipios=[330330]):
         """
-        atualizar a figura com
-        :return:
+        atualizar a figura com títulos, escalas e textos de hover
+        não altera o estado da instância: pode ser chamada simultaneamente por várias requisições
+        :param fig: a figura construída por construir_figura (alterada e retornada)
+        :param titulo: dicionário de títulos retornado por construir_figura
+        :return: a figura atualizada
         """
 
         dict_trad = {
             'obitos': 'óbitos',
             'casos': 'casos'
         }
-        self.fig.update_traces(connectgaps=True)
+        fig.update_traces(connectgaps=True)
 
-        self.fig.update_layout(xaxis_type=xlog, yaxis_type=ylog)
+        fig.update_layout(xaxis_type=xlog, yaxis_type=ylog)
         
         x_s = x + str(suavizacao)
         y_s = y + str(suavizacao)
 
         if normalizacao_pop == 'densidade_demografica':
-            for i, data in enumerate(self.fig['data']):
+            for i, data in enumerate(fig['data']):
                 local = data['name']
                 if self.estados_key[data_estados].isin([local]).any():
-                    self.fig['data'][i]['visible'] = 'legendonly'
+                    fig['data'][i]['visible'] = 'legendonly'
         #else:
-        #    for i in range(len(self.fig['data'])):
-        #        self.fig['data'][i]['visible'] = True
+        #    for i in range(len(fig['data'])):
+        #        fig['data'][i]['visible'] = True
         
         # se o eixo x for tempo, o título é o do gráfico
         if tempo_atempo == 'tempo':
-            self.fig.update_layout(
+            fig.update_layout(
                 hovermode = 'x unified',
-                title_text = self.titulo[y_s],
+                title_text = titulo[y_s],
                 yaxis_title_text = '',
-                xaxis_title_text = self.titulo[x_s]
+                xaxis_title_text = titulo[x_s]
             )
-            self.fig.update_traces(
+            fig.update_traces(
                 hovertemplate='%{y:.1f} ' + dict_trad[obitos_casos]
             )
         # caso contrário, o título vai para o eixo y, e o hovermode muda
         else:
-            self.fig.update_layout(
+            fig.update_layout(
                 hovermode = 'x',
                 title_text = 'Evolução da COVID-19 (' + dict_trad[obitos_casos] + ')',
-                yaxis_title_text = self.titulo[y_s],
-                xaxis_title_text = self.titulo[x_s]
+                yaxis_title_text = titulo[y_s],
+                xaxis_title_text = titulo[x_s]
             )
-            self.fig.update_traces(
+            fig.update_traces(
                 hovertemplate='%{y:.1f} ' + dict_trad[obitos_casos]
             )
 
+        return fig
+
     def __dash_cabecalho(self):
         """
 
@@ -275,9 +472,13 @@ class covid_plot:
             clearable=False
         )
 
-        fig = dcc.Graph(id='covid', figure=self.fig)
+        fig = dcc.Graph(id='covid')
+
+        # figura calculada no servidor, antes da aplicação da escala dos eixos
+        figura_dados = dcc.Store(id='figura_dados')
         
-        self.dash_builder['grafico'] = [ html.Div(id='figdiv', children=[ fig, dropdown_xlog, dropdown_ylog ]) ]
+        self.dash_builder['grafico'] = [ html.Div(id='figdiv', children=[ fig, dropdown_xlog, dropdown_ylog,
+                                                                          figura_dados ]) ]
 
     def __dash_opcoes(self):
         """
@@ -429,30 +630,38 @@ class covid_plot:
             app.callback(
                 Output(component_id='btndebug', component_property='children'),
                 [Input(component_id='btn', component_property='n_clicks')],
-                [State(component_id='covid', component_property='relayoutData')]
+                [State(component_id='covid', component_property='relayoutData'),
+                 State(component_id='figura_dados', component_property='data')]
             )(self.dbg_btn)
 
         return app
 
     # dash app callback
-    def atualizar_grafico(self, xlog, ylog,
-                          data_estados, data_municipios,
+    def atualizar_grafico(self, data_estados, data_municipios,
                           obitos_casos, total_novos, tempo_atempo,
                           suavizacao,
-                          normalizacao_pop, normalizacao_extra, norm_xy_list,
-                          fig
+                          normalizacao_pop, normalizacao_extra, norm_xy_list
                           ):
         """
-        selecionar x e y com base nas opções
-        :return: string x e y
+        construir a figura com base nas opções de dados.
+        a escala dos eixos (xlog, ylog) é aplicada no navegador (assets/clientside.js)
+        função pura das opções e dos dados (self.br, só leitura), de forma que pode rodar em várias threads ou
+        processos. A única alteração de estado é a troca dos dados quando há um snapshot novo (ver verificar_snapshot)
+        :return: figura do plotly
         """
-        x, y = self.selec_xy(obitos_casos, total_novos, tempo_atempo)
+        self.verificar_snapshot()
 
-        # acessar figura antes da atualização para saber o estado dos botoes de escala dos eixos
-        fig_old = fig
+        chave = self.chave_cache(data_estados, data_municipios,
+                                 obitos_casos, total_novos, tempo_atempo, suavizacao,
+                                 normalizacao_pop, normalizacao_extra, norm_xy_list)
+        fig = self.cache.obter(chave)
+        if fig is not None:
+            return fig
+
+        x, y = self.selec_xy(obitos_casos, total_novos, tempo_atempo)
 
         # normalizacao
-        normalizacao = normalizacao_extra
+        normalizacao = list(normalizacao_extra)
         if normalizacao_pop != 0:
             normalizacao += [ normalizacao_pop ]
 
@@ -464,43 +673,25 @@ class covid_plot:
         else:
             norm_xy = ''
         
-        self.fig, self.df_norm, self.titulo = self.construir_figura(
+        fig, df_norm, titulo = self.construir_figura(
             x=x, y=y,
             data_estados=data_estados, data_municipios=data_municipios,
             normalizacao=normalizacao, suavizacao=suavizacao,
             norm_xy=norm_xy
         )
 
-        self.atualizar_figura(x, y, xlog, ylog, suavizacao=suavizacao,
-                              obitos_casos=obitos_casos, tempo_atempo=tempo_atempo,
-                              normalizacao_pop=normalizacao_pop,
-                              data_estados=data_estados, data_municipios=data_municipios)
+        fig = self.atualizar_figura(fig, titulo, x, y, suavizacao=suavizacao,
+                                    obitos_casos=obitos_casos, tempo_atempo=tempo_atempo,
+                                    normalizacao_pop=normalizacao_pop,
+                                    data_estados=data_estados, data_municipios=data_municipios)
         
         # uirevision
-        self.fig['layout']['uirevision']='none'
+        fig['layout']['uirevision']='none'
 
-        return self.fig
-    
-    # dash app callback
-    def escala_eixo(self, tempo_atempo, ylog, eixo_norm):
-        """
-        selecionar escala do eixo a depender das opções
-        :param tempo_atempo: opção de eixo X temporal ou atemporal
-        :param xlog: escala do eixo y
-        :param eixo_norm: o qual eixo aplicar a normalização
-        :return: dash.Output: xlog e eixo_norm
-        """
-        if tempo_atempo == 'tempo':
-            xlog = 'linear'
-            eixo_norm = list(frozenset(eixo_norm) - frozenset(['x']))
-        
-        else:
-            xlog = ylog
-            if 'y' in eixo_norm:
-                eixo_norm = list(frozenset(eixo_norm) | frozenset(['x']))
-        
-        return xlog, eixo_norm
-        
+        # a figura guardada no cache não deve ser alterada depois daqui
+        self.cache.guardar(chave, fig)
+
+        return fig
 
     def selec_xy(self, obitos_casos, total_novos, tempo_atempo):
         """
@@ -516,20 +707,22 @@ class covid_plot:
 
         return 'x_' + st, 'y_' + st
 
-    def salvar(self, html_fig=None, img=None):
+    def salvar(self, fig, html_fig=None, img=None):
         """
         salvar as figuras
+        :param fig: figura do plotly (ou o dicionário guardado em 'figura_dados'). A figura não é lida da instância,
+            que é compartilhada por todas as sessões
+        :param html_fig: arquivo HTML. Se None, não salva
+        :param img: arquivo de imagem (ex.: PNG). Se None, não salva
         :return: None
         """
-
-        html_fig = r'..\..\imgs (nogit)\img.html'
-        img = r'..\..\imgs (nogit)\img.png'
+        fig = go.Figure(fig)
 
         if html_fig is not None:
-            self.fig.write_html(html_fig)
+            fig.write_html(html_fig)
 
         if img is not None:
-            self.fig.write_image(img)
+            fig.write_image(img)
 
     def get_app_id(self, id):
         return self.dashapp.layout._get_set_or_delete(id=id, operation='get')
@@ -538,21 +731,29 @@ class covid_plot:
         return self.dashapp.layout._get_set_or_delete(id=id, operation='set', new_item=new)
 
     # debug callback
-    def dbg_btn(self, n_clicks, relayout):
+    def dbg_btn(self, n_clicks, relayout, fig):
+        # a figura da sessão vem de 'figura_dados': a instância é compartilhada por todas as sessões
         #fig = self.get_app_id(id='covid').figure
-        fig = self.fig
-        txt1 = fig['layout']['xaxis']['type'] or ''
+        if fig is None:
+            return ''
+        txt1 = fig['layout'].get('xaxis', {}).get('type') or ''
         txt = 'Escala eixo X: ' + txt1 + '\\n'
         txt += r'\\n' + str(relayout)
         return txt
 
-# carregar o cache ao inves de processar os dados
-# br = covid.covid_brasil(diretorio = None, graficos = False)
-br = covid.dumbcache_load(cache_dir=r'..\data\cache')
+# COVID_DASHAPP_SNAPSHOT=0: só as classes, sem carregar dados nem montar o servidor (ex.: ..\benchmark.py)
+if os.environ.get('COVID_DASHAPP_SNAPSHOT', '1') != '0':
+    # carregar o cache ao inves de processar os dados
+    # br = covid.covid_brasil(diretorio = None, graficos = False)
+    # br = covid.dumbcache_load(cache_dir=r'..\data\cache')
+    br = covid.snapshot_load(cache_dir=snapshot_dir)
+
+    plt = covid_plot(br, snapshot_dir=snapshot_dir)
 
-plt = covid_plot(br)
+    # servidor WSGI, para rodar com vários processos/threads (ex.: gunicorn -w 4 --threads 4 dashapp:server)
+    # todos os processos mapeiam os mesmos arquivos do snapshot: a memória por processo é quase constante
+    server = plt.dashapp.server
 
-#if __name__ == '__main__':
-if True:
+if __name__ == '__main__':
     if os.environ.get('PYCHARM_HOSTED', default=0) == 0:
-        plt.dashapp.run_server(debug=True)
\ No newline at end of file
+        plt.dashapp.run_server(debug=True, threaded=True)
\ No newline at end of file
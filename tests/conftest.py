@@ -0,0 +1,87 @@
+import os
+import os.path
+import sys
+import locale
+
+import matplotlib
+matplotlib.use('Agg')
+
+import pandas as pd
+import pytest
+
+SCRIPTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), r'..', r'scripts')
+if SCRIPTS not in sys.path:
+    sys.path.insert(0, SCRIPTS)
+
+# covid.py ajusta o locale para 'portuguese_brazil' (nome do Windows) ao ser importado.
+# fora do Windows, o locale atual é mantido
+_setlocale = locale.setlocale
+
+def setlocale_tolerante(categoria, nome=None):
+    try:
+        return _setlocale(categoria, nome)
+    except locale.Error:
+        return _setlocale(categoria)
+
+locale.setlocale = setlocale_tolerante
+try:
+    import covid
+    import benchmark
+finally:
+    locale.setlocale = _setlocale
+
+# tamanho dos dados sintéticos dos testes (ver benchmark.gerar_hist_painel)
+n_locais = 40
+n_dias = 60
+
+@pytest.fixture(scope='session')
+def fontes(tmp_path_factory):
+    """
+    dados brutos sintéticos, como os entrega covid_brasil.ler_dados, lidos uma vez por sessão
+    :return: dicionário { 'diretorio', 'covidbr', 'areas', 'areas_estados', 'demobr', 'demomun' }
+    """
+    diretorio = str(tmp_path_factory.mktemp('dados'))
+    arquivo = benchmark.gerar_hist_painel(diretorio, n_locais=n_locais, n_dias=n_dias)
+
+    br = covid.covid_brasil.__new__(covid.covid_brasil)
+    covidbr, _, _, demobr, demomun = br.ler_dados(diretorio, fontes=['hist_painel', 'demografia_br', 'demografia_mun'])
+    areas, areas_estados = benchmark.gerar_areas(arquivo)
+
+    return dict(diretorio=diretorio, covidbr=covidbr, areas=areas, areas_estados=areas_estados,
+                demobr=demobr, demomun=demomun)
+
+@pytest.fixture(scope='session')
+def bruto(fontes):
+    """
+    :return: função que devolve uma cópia dos dados brutos de HIST_PAINEL_COVIDBR, opcionalmente só com
+        os primeiros dias
+    """
+    def bruto(dias=None):
+        covidbr = fontes['covidbr']
+        if dias is None:
+            return covidbr.copy()
+
+        data = covidbr['data']
+        return covidbr[data < data.min() + pd.Timedelta(days=dias)].reset_index(drop=True)
+
+    return bruto
+
+@pytest.fixture(scope='session')
+def construir(fontes, bruto):
+    """
+    :return: função que constrói covid_brasil (como em covid_brasil.__init__, sem memoização nem gráficos)
+        a partir dos dados sintéticos, opcionalmente só com os primeiros dias
+    """
+    def construir(dias=None):
+        br = covid.covid_brasil.__new__(covid.covid_brasil)
+        br.relatorio_etapas = []
+
+        br.covidbr = bruto(dias)
+        for nome in [ 'areas', 'areas_estados', 'demobr', 'demomun' ]:
+            setattr(br, nome, fontes[nome].copy())
+
+        br.preproc()
+        br.transform()
+        return br
+
+    return construir
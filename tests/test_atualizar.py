@@ -0,0 +1,55 @@
+import pandas as pd
+import pytest
+
+
+dias_base = 40
+
+def ordenar(br, tabela, mascara):
+    """
+    tabela com os atributos dos locais e a máscara de resumos, ordenada por local e data
+    """
+    df = br.juntar_locais(getattr(br, tabela))
+    df['mascara'] = getattr(br, mascara).reindex(df.index).values
+
+    return df.sort_values(['id_local', 'data']).reset_index(drop=True)
+
+@pytest.mark.parametrize('dias_novos', [1, 10])
+def test_atualizar_igual_reconstrucao(construir, bruto, dias_novos):
+    br = construir(dias_base)
+    completo = construir(dias_base + dias_novos)
+
+    br.ler_hist_painel = lambda diretorio: bruto(dias_base + dias_novos)
+    br.atualizar()
+
+    for tabela, mascara in [ ('covidbr', 'mask_exc_resumo'), ('covidrel', 'mask_exc_resumo_rel') ]:
+        # as máscaras são alinhadas às tabelas
+        assert getattr(br, mascara).index.equals(getattr(br, tabela).index)
+
+        esperado, obtido = ordenar(completo, tabela, mascara), ordenar(br, tabela, mascara)
+        assert set(obtido.columns) == set(esperado.columns)
+        pd.testing.assert_frame_equal(obtido[esperado.columns], esperado)
+
+    pd.testing.assert_frame_equal(br.locais, completo.locais)
+
+    # covidrel ordenado por local e data, com os mesmos intervalos por local
+    pd.testing.assert_frame_equal(br.indice_rel, completo.indice_rel)
+    pd.testing.assert_frame_equal(br.covidrel.reset_index(drop=True), completo.covidrel.reset_index(drop=True))
+
+@pytest.mark.parametrize('dias_historico', [20, 40])
+def test_atualizar_nao_cresce_com_historico(construir, bruto, monkeypatch, dias_historico):
+    import covid
+
+    br = construir(dias_historico)
+    br.ler_hist_painel = lambda diretorio: bruto(dias_historico + 1)
+
+    monkeypatch.setattr(covid, 'instrumentar', True)
+    br.atualizar()
+
+    # as etapas da atualização só veem as linhas novas e o contexto de cada local, qualquer que seja o histórico
+    n_contexto = (covid.janela_semana - 1) + (max(covid.mm_janelas) - 1)
+    limite = len(br.locais) * (n_contexto + 1)
+
+    etapas = br.relatorio_desempenho()
+    assert len(etapas) > 0
+    assert (etapas['linhas'] <= limite).all()
+    assert len(br.covidbr) > limite
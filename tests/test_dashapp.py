@@ -0,0 +1,54 @@
+import os
+import os.path
+import importlib.util
+
+import pytest
+
+pytest.importorskip('dash')
+pytest.importorskip('plotly')
+pytest.importorskip('thesmuggler')
+
+WEBAPP = os.path.join(os.path.dirname(os.path.abspath(__file__)), r'..', r'scripts', r'webapp')
+
+@pytest.fixture(scope='module')
+def dashapp():
+    """
+    webapp/dashapp.py sem carregar o snapshot nem montar o servidor (ver COVID_DASHAPP_SNAPSHOT)
+    """
+    diretorio, ambiente = os.getcwd(), os.environ.get('COVID_DASHAPP_SNAPSHOT')
+    os.chdir(WEBAPP)
+    os.environ['COVID_DASHAPP_SNAPSHOT'] = '0'
+    try:
+        spec = importlib.util.spec_from_file_location('dashapp', os.path.join(WEBAPP, r'dashapp.py'))
+        modulo = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(modulo)
+        return modulo
+    finally:
+        os.chdir(diretorio)
+        if ambiente is None:
+            del os.environ['COVID_DASHAPP_SNAPSHOT']
+        else:
+            os.environ['COVID_DASHAPP_SNAPSHOT'] = ambiente
+
+def test_snapshot_novo_invalida_cache(dashapp, construir, tmp_path, monkeypatch):
+    monkeypatch.setattr(dashapp, 'snapshot_verificacao', 0)
+
+    construir(30).snapshot_dump(cache_dir=str(tmp_path))
+    plot = dashapp.covid_plot(dashapp.covid.snapshot_load(cache_dir=str(tmp_path)),
+                              aquecer=False, snapshot_dir=str(tmp_path))
+
+    opcoes = dict(data_estados=[76], data_municipios=[],
+                  obitos_casos='obitos', total_novos='total', tempo_atempo='tempo', suavizacao=7,
+                  normalizacao_pop='percapita', normalizacao_extra=[], norm_xy_list=['y'])
+
+    plot.atualizar_grafico(**opcoes)
+    plot.atualizar_grafico(**opcoes)
+    assert (plot.cache.falhas, plot.cache.acertos) == (1, 1)
+
+    # um snapshot novo é publicado: a mesma seleção não pode vir do cache
+    versao = plot.versao_dados()
+    construir(40).snapshot_dump(cache_dir=str(tmp_path))
+
+    plot.atualizar_grafico(**opcoes)
+    assert plot.versao_dados() != versao
+    assert (plot.cache.falhas, plot.cache.acertos) == (2, 1)
@@ -0,0 +1,75 @@
+import threading
+
+import pytest
+
+import covid
+
+@pytest.fixture
+def br():
+    """
+    instância que só registra as etapas rodadas, sem rodá-las
+    """
+    br = covid.covid_brasil.__new__(covid.covid_brasil)
+    br.rodadas = []
+    br.sequencias = []
+    trava = threading.Lock()
+
+    def rodar_etapa(etapa):
+        with trava:
+            br.rodadas.append(etapa)
+
+    def rodar_etapas(nomes):
+        with trava:
+            br.sequencias.append(list(nomes))
+        for etapa in nomes:
+            br.rodar_etapa(etapa)
+
+    br.rodar_etapa = rodar_etapa
+    br.rodar_etapas = rodar_etapas
+    return br
+
+@pytest.mark.parametrize('fase', [ 'preproc', 'norm' ])
+@pytest.mark.parametrize('paralelo', [ True, False ])
+def test_ordem_das_dependencias(br, fase, paralelo):
+    br.executar_etapas(fase, paralelo=paralelo)
+
+    na_fase = [ etapa for etapa, info in covid.etapas.items() if info['fase'] == fase ]
+    assert sorted(br.rodadas) == sorted(na_fase)
+
+    # cada etapa roda depois das etapas da fase que produzem as suas entradas
+    produtor = { saida: etapa for etapa in na_fase for saida in covid.etapas[etapa]['saidas'] }
+    for etapa in na_fase:
+        for entrada in covid.etapas[etapa]['entradas']:
+            if entrada in produtor:
+                assert br.rodadas.index(produtor[entrada]) < br.rodadas.index(etapa)
+
+def test_norm_em_uma_sequencia(br):
+    # todas as etapas da fase 'norm' escrevem em covidbr: nunca rodam simultaneamente
+    br.executar_etapas('norm', paralelo=True)
+
+    assert br.sequencias == [ [ etapa for etapa, info in covid.etapas.items() if info['fase'] == 'norm' ] ]
+
+@pytest.mark.parametrize('fase, saidas, esperadas', [
+    ('preproc', [ 'covidbr.area' ], [ 'preproc_covid', 'preproc_areas', 'enriquecer_areas' ]),
+    ('preproc', [ 'demobr' ], [ 'preproc_demobr' ]),
+    ('norm', [ 'covidbr.norm_demo' ], [ 'norm_perfil_demografico' ]),
+    ('norm', [ 'covidbr.area' ], [ ]),
+])
+def test_saidas_podam_etapas(br, fase, saidas, esperadas):
+    assert covid.etapas_necessarias(fase, saidas) == esperadas
+
+    br.executar_etapas(fase, saidas=saidas)
+    assert sorted(br.rodadas) == sorted(esperadas)
+
+def test_dependencia_circular(br, monkeypatch):
+    monkeypatch.setattr(covid, 'etapas', {
+        'a': {'fase': 'teste', 'entradas': ['y'], 'saidas': ['x']},
+        'b': {'fase': 'teste', 'entradas': ['x'], 'saidas': ['y']},
+        'c': {'fase': 'teste', 'entradas': [], 'saidas': ['z']},
+    })
+
+    with pytest.raises(ValueError, match='circular'):
+        br.executar_etapas('teste')
+
+    # as etapas fora do ciclo rodam antes do erro
+    assert br.rodadas == [ 'c' ]
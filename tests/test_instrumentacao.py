@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+import covid
+
+@pytest.fixture
+def instrumentar(monkeypatch):
+    monkeypatch.setattr(covid, 'instrumentar', True)
+
+def test_desligada_por_padrao(construir):
+    br = construir()
+    assert br.relatorio_desempenho().empty
+
+def test_relatorio_das_etapas(instrumentar, construir):
+    br = construir()
+    relatorio = br.relatorio_desempenho()
+
+    esperadas = set(covid.etapas) | { 'substituir_nomes', 'casos_obitos_ultima_semana', 'suavizacao',
+                                      'dias_desde_obito_percapita', 'separar_locais' }
+    assert esperadas <= set(relatorio['etapa'])
+    assert (relatorio['tempo'] >= 0).all() and (relatorio['linhas'] > 0).all()
+
+@pytest.mark.skipif(covid.rss_atual() is None, reason='memória residente não mensurável sem psutil fora do Linux')
+def test_pico_rss_por_etapa(instrumentar):
+    # cada etapa vê o próprio pico, mesmo depois de uma etapa anterior ter levado o processo a um pico maior
+    br = covid.covid_brasil.__new__(covid.covid_brasil)
+    br.relatorio_etapas = []
+
+    for etapa, tamanho in [ ('grande', 400), ('menor', 200) ]:
+        with br.medir(etapa):
+            bloco = np.ones(tamanho * 2**20 // 8)
+            for _ in range(3):
+                bloco += 1
+            del bloco
+
+    picos = br.relatorio_desempenho().set_index('etapa')['pico_rss']
+    assert picos['grande'] > 300 * 2**20
+    assert picos['menor'] > 150 * 2**20
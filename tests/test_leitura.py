@@ -0,0 +1,31 @@
+import pandas as pd
+
+import covid
+
+def preproc_covid(covidbr):
+    br = covid.covid_brasil.__new__(covid.covid_brasil)
+    br.covidbr = covidbr
+    br._covid_brasil__preproc_covid()
+    return br
+
+def test_pyarrow_tipos_finais(fontes):
+    br = covid.covid_brasil.__new__(covid.covid_brasil)
+    bruto = br.ler_hist_painel(fontes['diretorio'], motor='pyarrow')
+
+    assert isinstance(bruto['data'].dtype, pd.DatetimeTZDtype)
+    for coluna in [ 'regiao', 'estado', 'municipio', 'nomeRegiaoSaude' ]:
+        assert isinstance(bruto[coluna].dtype, pd.CategoricalDtype)
+
+    tipos = covid.tipos_contagens(bruto, [ c for c in covid.colunas_contagens if c != 'populacaoTCU2019' ])
+    assert { c: str(bruto[c].dtype) for c in tipos } == tipos
+
+def test_pyarrow_igual_pandas(fontes):
+    br = covid.covid_brasil.__new__(covid.covid_brasil)
+    pyarrow = preproc_covid(br.ler_hist_painel(fontes['diretorio'], motor='pyarrow'))
+    pandas = preproc_covid(br.ler_hist_painel(fontes['diretorio'], motor='pandas'))
+
+    # os nomes de locais só viram categóricos em substituir_nomes, para o leitor pandas
+    nomes = [ 'regiao', 'estado', 'municipio', 'nomeRegiaoSaude' ]
+    pd.testing.assert_frame_equal(pyarrow.covidbr.drop(columns=nomes), pandas.covidbr.drop(columns=nomes))
+    for coluna in nomes:
+        pd.testing.assert_series_equal(pyarrow.covidbr[coluna].astype('string'), pandas.covidbr[coluna].astype('string'))
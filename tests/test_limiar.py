@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import covid
+
+@pytest.fixture(scope='module')
+def br(construir):
+    return construir()
+
+def test_padrao_igual_dias_desde_obito_MMhab(br):
+    # limiar padrão (0.1 óbito por MM hab.): as linhas de covidrel e os dias contados a partir delas
+    dias = br.dias_desde_limiar()
+
+    assert dias.dropna().index.sort_values().equals(br.covidrel.index.sort_values())
+    np.testing.assert_array_equal(dias.reindex(br.covidrel.index).to_numpy(),
+                                  br.covidrel['dias_desde_obito_MMhab'].to_numpy(dtype=float))
+
+def test_limiar_absoluto_igual_varredura(br):
+    # 100 casos, sem normalização: primeira data de cada local com casosAcumulado >= 100
+    datas = br.limiar_locais(metrica='casos', limiar=100, normalizacao=None)
+
+    dados = br.juntar_locais(br.covidbr)
+    esperado = {}
+    for chave, local in dados.groupby('id_local', sort=False):
+        local = local.sort_values('data')
+        atingiu = local['casosAcumulado'].to_numpy() >= 100
+        esperado[chave] = local['data'].iloc[atingiu.argmax()] if atingiu.any() else pd.NaT
+
+    # indexado pela chave dos locais
+    assert datas.index.name == 'id_local'
+    assert len(datas) == len(esperado) == len(br.locais)
+    assert datas.notnull().any() and datas.isnull().any()
+    for chave, data in datas.items():
+        assert (pd.isnull(data) and pd.isnull(esperado[chave])) or data == esperado[chave]
+
+    # e os dias desde o limiar contam a partir dessas datas
+    dias = br.dias_desde_limiar(metrica='casos', limiar=100, normalizacao=None)
+    ref = pd.Series(datas.values, index=datas.index).reindex(dados['id_local'])
+    esperado_dias = np.floor(np.asarray((dados['data'].values - ref.values) / pd.Timedelta(days=1), dtype=float))
+    esperado_dias[esperado_dias < 0] = np.nan
+
+    np.testing.assert_array_equal(dias.to_numpy(), esperado_dias)
+
+def test_linhas_fora_de_covidbr(br):
+    # linhas que não estão em covidbr não recebem os dias de outro local
+    dados = br.covidbr.iloc[:3].copy()
+    dados.index = dados.index + br.covidbr.index.max() + 1
+
+    with pytest.raises(KeyError):
+        br.dias_desde_limiar(dados=dados)
@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import covid
+
+@pytest.fixture(scope='module')
+def br(construir):
+    return construir()
+
+@pytest.fixture(scope='module')
+def sem_separar(fontes, bruto):
+    """
+    construção com as colunas dos locais em cada linha, como antes de separar_locais
+    """
+    br = covid.covid_brasil.__new__(covid.covid_brasil)
+    br.relatorio_etapas = []
+
+    br.covidbr = bruto()
+    for nome in [ 'areas', 'areas_estados', 'demobr', 'demomun' ]:
+        setattr(br, nome, fontes[nome].copy())
+
+    br.separar_locais = lambda: None
+    br.indexar_covidrel = lambda: None
+
+    br.preproc()
+    br.transform()
+    return br
+
+def esperado_locais(br, bruto):
+    """
+    atributos dos locais de cada linha, calculados como no código original: nomes substituídos por máscaras,
+    área e % de idosos por LEFT JOIN (estado e depois município), local concatenando os nomes
+    """
+    df = bruto.copy()
+    codmun = df['codmun'].astype('float')
+
+    fora = df['municipio'].isnull() & codmun.notnull() & (codmun < 999999) & (codmun > 99999) & (codmun % 10**4 == 0)
+    resumo_estado = df['municipio'].isnull() & codmun.isnull()
+    brasil = df['estado'].isnull()
+
+    df['municipio'] = df['municipio'].astype(object)
+    df['estado'] = df['estado'].astype(object)
+    df.loc[fora, 'municipio'] = 'SEM MUNICÍPIO'
+    df.loc[resumo_estado, 'municipio'] = 'RESUMO'
+    df.loc[brasil, ['municipio', 'estado']] = 'Brasil'
+    df['codmun'] = codmun.mask(brasil, 760001)
+
+    df['local'] = df['municipio'] + ', ' + df['estado']
+    df.loc[resumo_estado, 'local'] = df['estado']
+    df.loc[brasil, 'local'] = 'Brasil'
+
+    df['tipo_local'] = np.select([brasil, resumo_estado, fora],
+                                 [covid.tipos_local['brasil'], covid.tipos_local['resumo_estado'],
+                                  covid.tipos_local['sem_municipio']],
+                                 default=covid.tipos_local['municipio'])
+
+    area_estado = df['coduf'].map(br.areas_estados['area'])
+    area_municipio = df['codmun'].map(pd.Series(br.areas['area'].values,
+                                                index=br.areas.index.get_level_values('codmun').astype(float)))
+    df['area'] = area_municipio.where(area_municipio.notnull(), area_estado)
+
+    velhos = br.demo_velhos
+    velhos_estados = velhos.groupby('coduf')['pop_velhos'].sum() / velhos.groupby('coduf')['pop_total_2015'].sum()
+    velhos_estados[76] = velhos['pop_velhos'].sum() / velhos['pop_total_2015'].sum()
+    pct_estado = df['coduf'].map(velhos_estados.astype(float))
+    pct_municipio = df['codmun'].map(pd.Series(velhos['pct_velhos'].values, index=velhos['codmun'].astype(float)))
+    df['pct_velhos'] = pct_municipio.where(pct_municipio.notnull(), pct_estado).astype(float)
+
+    return df
+
+def test_tipos_de_local_presentes(br):
+    assert set(br.locais['tipo_local']) == set(covid.tipos_local.values())
+
+def test_juntar_locais_igual_sem_separar(br, sem_separar):
+    # mesmas linhas, colunas e valores (inclusive tipos) que a construção sem a tabela de locais
+    for tabela in [ 'covidbr', 'covidrel' ]:
+        juntado = br.juntar_locais(getattr(br, tabela)).drop(columns='id_local')
+        original = getattr(sem_separar, tabela)
+
+        assert set(juntado.columns) == set(original.columns)
+        pd.testing.assert_frame_equal(juntado.loc[original.index, original.columns], original)
+
+def test_atributos_dos_locais(br, bruto):
+    esperado = esperado_locais(br, bruto())
+    obtido = br.juntar_locais(br.covidrel)
+    esperado = esperado.loc[obtido.index]
+
+    for coluna in [ 'regiao', 'estado', 'municipio', 'nomeRegiaoSaude', 'local' ]:
+        pd.testing.assert_series_equal(obtido[coluna].astype('string'), esperado[coluna].astype('string'),
+                                       check_names=False)
+
+    for coluna in [ 'coduf', 'codmun', 'tipo_local', 'area', 'pct_velhos' ]:
+        np.testing.assert_allclose(obtido[coluna].to_numpy(dtype=float, na_value=np.nan),
+                                   esperado[coluna].to_numpy(dtype=float, na_value=np.nan), rtol=1e-12)
+
+    # resumos, SEM MUNICÍPIO e Brasil
+    brasil = obtido[obtido['tipo_local'] == covid.tipos_local['brasil']]
+    assert len(brasil) > 0
+    assert (brasil[['estado', 'municipio', 'local']].astype(object) == 'Brasil').all().all()
+    assert (brasil['codmun'] == 760001).all()
+    assert (brasil['area'] == br.area_brasil.at[76, 'area']).all()
+
+    resumos = obtido[obtido['tipo_local'] == covid.tipos_local['resumo_estado']]
+    assert len(resumos) > 0
+    assert (resumos['municipio'].astype(object) == 'RESUMO').all()
+    assert (resumos['local'].astype(object) == resumos['estado'].astype(object)).all()
+
+    fora = br.juntar_locais(br.covidbr)
+    fora = fora[fora['tipo_local'] == covid.tipos_local['sem_municipio']]
+    assert len(fora) > 0
+    assert (fora['municipio'].astype(object) == 'SEM MUNICÍPIO').all()
@@ -0,0 +1,64 @@
+import os
+import os.path
+import shutil
+
+import pandas as pd
+import pytest
+
+import covid
+
+@pytest.fixture
+def raiz(fontes, tmp_path, monkeypatch):
+    """
+    diretório raiz com os dados brutos sintéticos. A planilha de áreas é um arquivo qualquer (entra só na
+    impressão digital da memoização): a leitura dela devolve as áreas sintéticas, e as leituras são contadas
+    """
+    DATADIR = os.path.join(str(tmp_path), r'data', r'Brasil')
+    shutil.copytree(os.path.join(fontes['diretorio'], r'data', r'Brasil'), DATADIR)
+    with open(os.path.join(DATADIR, r'AR_BR_RG_UF_RGINT_RGIM_MES_MIC_MUN_2019.xls'), 'wb') as f:
+        f.write(b'planilha de areas')
+
+    leituras = []
+    def read_excel(arquivo, sheet_name):
+        leituras.append(arquivo)
+        return { 'AR_BR_MUN_2019': fontes['areas'].copy(), 'AR_BR_UF_2019': fontes['areas_estados'].copy() }
+    monkeypatch.setattr(covid.pd, 'read_excel', read_excel)
+
+    return str(tmp_path), leituras
+
+def test_memo_reaproveitada(raiz):
+    diretorio, leituras = raiz
+
+    primeira = covid.covid_brasil(diretorio, graficos=False)
+    assert len(leituras) == 1
+
+    segunda = covid.covid_brasil(diretorio, graficos=False)
+    assert len(leituras) == 1
+    pd.testing.assert_frame_equal(segunda.juntar_locais(segunda.covidbr), primeira.juntar_locais(primeira.covidbr))
+
+@pytest.mark.parametrize('conteudo', [
+    b'',                                        # EOFError
+    b'lixo',                                    # UnpicklingError
+    b'cmodulo_inexistente\nClasse\n.',          # ModuleNotFoundError (pickle de outro ambiente)
+])
+def test_memo_ilegivel(raiz, conteudo):
+    # a memoização ilegível vira uma falta: a planilha (não lida por causa da memoização) é lida, e a etapa roda
+    diretorio, leituras = raiz
+
+    primeira = covid.covid_brasil(diretorio, graficos=False)
+
+    pasta = primeira._memo['dir']
+    for arquivo in os.listdir(pasta):
+        if arquivo.startswith('preproc_areas-'):
+            with open(os.path.join(pasta, arquivo), 'wb') as f:
+                f.write(conteudo)
+
+    segunda = covid.covid_brasil(diretorio, graficos=False)
+    assert len(leituras) == 2
+    pd.testing.assert_frame_equal(segunda.juntar_locais(segunda.covidbr), primeira.juntar_locais(primeira.covidbr))
+    pd.testing.assert_frame_equal(segunda.areas, primeira.areas)
+
+    # e a memoização é regravada
+    terceira = covid.covid_brasil(diretorio, graficos=False)
+    assert len(leituras) == 2
+    pd.testing.assert_frame_equal(terceira.areas, primeira.areas)
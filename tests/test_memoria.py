@@ -0,0 +1,40 @@
+import pytest
+
+import covid
+
+@pytest.fixture(scope='module')
+def br(construir):
+    return construir()
+
+def test_relatorio_memoria_linha_de_base(br):
+    relatorio = br.relatorio_memoria()
+
+    # colunas fora das contagens e que não são reais não têm economia
+    for tabela, coluna in [ ('covidbr', 'id_local'), ('covidbr', 'dias_caso_0'), ('locais', 'tipo_local') ]:
+        assert relatorio.at[(tabela, coluna), 'economia'] == 0
+
+    # contagens sem nulos como int64, contra a referência nominal Int64: economiza-se a máscara (1 byte por linha)
+    assert covid.tipo_referencia_contagens == 'Int64'
+    assert str(br.covidbr['casosNovos'].dtype) == 'int64'
+    assert relatorio.at[('covidbr', 'casosNovos'), 'economia'] == len(br.covidbr)
+
+def test_relatorio_memoria_sugestoes(br):
+    relatorio = br.relatorio_memoria()
+
+    assert relatorio['bytes'].is_monotonic_decreasing
+    assert relatorio['pct'].sum() == pytest.approx(1)
+
+    # categorias e datas não recebem sugestão; a economia sugerida é zero sem sugestão
+    assert relatorio.at[('covidbr', 'data'), 'tipo_sugerido'] is None
+    sem_sugestao = relatorio[relatorio['tipo_sugerido'].isnull()]
+    assert (sem_sugestao['economia_sugerida'] == 0).all()
+
+def test_tipo_mais_barato():
+    import pandas as pd
+
+    assert covid.tipo_mais_barato(pd.Series([1, 2, 300], dtype='int64')) == 'int16'
+    assert covid.tipo_mais_barato(pd.Series([1., None, 3.])) == 'Int8'
+    assert covid.tipo_mais_barato(pd.Series([0.1, 0.2, 0.3])) == 'float32'
+    assert covid.tipo_mais_barato(pd.Series([0.1, 0.2, 0.3]), tolerancia=1e-12) is None
+    assert covid.tipo_mais_barato(pd.Series(['a', 'b', 'a', 'a'])) == 'category'
+    assert covid.tipo_mais_barato(pd.Series(['a', 'b'], dtype='category')) is None
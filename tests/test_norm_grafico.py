@@ -0,0 +1,26 @@
+import pandas as pd
+import pytest
+
+import covid
+
+@pytest.fixture(scope='module')
+def br(construir):
+    return construir()
+
+@pytest.mark.parametrize('normalizacao', [ None, ['percapita'], ['percapita', 'densidade_demografica'] ])
+@pytest.mark.parametrize('norm_xy', [ '', 'y', 'xy' ])
+def test_chaves_igual_caminho_completo(br, normalizacao, norm_xy):
+    municipios = br.locais['codmun'].dropna().astype(int).tolist()[-2:]
+    dados = br.series_rel(estados=[ 76 ], municipios=municipios)
+
+    completo, titulos, _ = br.norm_grafico(dados=dados, normalizacao=normalizacao, norm_xy=norm_xy, plotly=True)
+
+    for k in covid.chaves_plotly:
+        parcial, titulo, _ = br.norm_grafico(dados=dados, normalizacao=normalizacao, norm_xy=norm_xy, plotly=True,
+                                             chaves=[ k ])
+
+        # só a série pedida (e as colunas em manter), com os mesmos valores e título do caminho completo
+        assert list(parcial.columns) == [ 'local', k ]
+        pd.testing.assert_series_equal(parcial[k], completo[k])
+        pd.testing.assert_series_equal(parcial['local'], completo['local'])
+        assert titulo == { k: titulos[k] }
@@ -0,0 +1,69 @@
+import pandas as pd
+import pytest
+
+import covid
+
+@pytest.fixture(scope='module')
+def br(construir):
+    return construir()
+
+@pytest.fixture
+def snapshot(br, tmp_path):
+    br.snapshot_dump(cache_dir=str(tmp_path))
+    return covid.snapshot_load(cache_dir=str(tmp_path))
+
+def comparar(obtido, esperado):
+    # níveis de índice com inteiros mascarados (Int64) voltam como inteiros do numpy: os valores são
+    # comparados, a classe do índice não
+    if isinstance(esperado, pd.Series):
+        pd.testing.assert_series_equal(obtido, esperado, check_index_type=False)
+    else:
+        pd.testing.assert_frame_equal(obtido, esperado, check_index_type=False)
+
+def test_ida_e_volta(br, snapshot):
+    for nome in covid.snapshot_tabelas:
+        if nome in br.__dict__:
+            comparar(getattr(snapshot, nome), getattr(br, nome))
+
+    for nome in covid.snapshot_atributos:
+        if nome in br.__dict__:
+            assert getattr(snapshot, nome) == getattr(br, nome)
+
+def test_covidrel_preguicoso(br, snapshot):
+    # nada é lido antes do primeiro acesso
+    assert 'covidrel' not in snapshot.__dict__
+    assert not snapshot.materializado('covidrel')
+
+    # consultas por local leem só as fatias do arquivo mapeado
+    estados, municipios = [ 76 ], br.locais['codmun'].dropna().astype(int).tolist()[-2:]
+    comparar(snapshot.series_rel(estados=estados, municipios=municipios),
+             br.series_rel(estados=estados, municipios=municipios))
+    assert 'covidrel' not in snapshot.__dict__
+
+    # o primeiro acesso ao atributo materializa a tabela
+    comparar(snapshot.covidrel, br.covidrel)
+    assert snapshot.materializado('covidrel')
+
+def test_snapshot_novo_nao_mistura_tabelas(br, construir, tmp_path):
+    br.snapshot_dump(cache_dir=str(tmp_path))
+    antigo = covid.snapshot_load(cache_dir=str(tmp_path))
+
+    # um snapshot novo (com outro histórico) é salvo enquanto o antigo está em uso
+    outro = construir(30)
+    id_novo = outro.snapshot_dump(cache_dir=str(tmp_path))
+    assert covid.snapshot_atual(cache_dir=str(tmp_path)) == id_novo
+
+    # o processo antigo continua lendo todas as tabelas do seu próprio snapshot
+    comparar(antigo.indice_rel, br.indice_rel)
+    comparar(antigo.covidrel, br.covidrel)
+
+    # e um processo novo lê só o snapshot novo
+    novo = covid.snapshot_load(cache_dir=str(tmp_path))
+    comparar(novo.indice_rel, outro.indice_rel)
+    comparar(novo.covidrel, outro.covidrel)
+
+def test_snapshots_antigos_descartados(br, tmp_path):
+    ids = [ br.snapshot_dump(cache_dir=str(tmp_path)) for _ in range(covid.snapshot_manter + 2) ]
+
+    restantes = sorted(p.name for p in tmp_path.iterdir() if p.is_dir())
+    assert restantes == ids[-covid.snapshot_manter:]
@@ -0,0 +1,90 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import covid
+
+janelas = [1, 2, 3, 7, 14]
+
+def dados(fracionarios, correcoes, semente=0):
+    """
+    grupos de tamanhos variados (inclusive de uma linha) com contagens grandes, trechos de zeros e alguns NaN
+    :param fracionarios: se True, valores reais; senão, contagens inteiras
+    :param correcoes: se True, parte dos valores é anulada na linha seguinte (correção negativa), de forma que
+        algumas janelas somam exatamente zero: o pior caso para o cancelamento na soma acumulada
+    :return: (valores (n, 2), grupos (n,))
+    """
+    rng = np.random.default_rng(semente)
+    tamanhos = rng.integers(1, 60, 300)
+    grupos = np.repeat(np.arange(len(tamanhos)), tamanhos)
+    n = len(grupos)
+
+    valores = rng.poisson(1e6, (n, 2)).astype(float)
+    if fracionarios:
+        valores += rng.uniform(0.1, 1., (n, 2))
+    valores[rng.random((n, 2)) < 0.3] = 0.
+
+    if correcoes:
+        linhas = np.flatnonzero(rng.random(n - 1) < 0.2)
+        valores[linhas + 1] = -valores[linhas]
+
+    valores[rng.random((n, 2)) < 0.02] = np.nan
+
+    return valores, grupos
+
+def esperado(valores, grupos, janela):
+    """
+    soma exata (math.fsum) de cada janela completa dentro do grupo; NaN se incompleta ou com NaN
+    """
+    ref = np.full(valores.shape, np.nan)
+    for i in range(len(valores)):
+        if i - janela + 1 >= 0 and grupos[i - janela + 1] == grupos[i]:
+            for j in range(valores.shape[1]):
+                janela_valores = valores[i - janela + 1:i + 1, j]
+                if not np.isnan(janela_valores).any():
+                    ref[i, j] = math.fsum(janela_valores)
+
+    return ref
+
+@pytest.mark.parametrize('fracionarios', [False, True])
+@pytest.mark.parametrize('correcoes', [False, True])
+def test_igual_rolling(fracionarios, correcoes):
+    valores, grupos = dados(fracionarios, correcoes)
+    somas = covid.somas_moveis_agrupadas(valores, grupos, janelas)
+
+    escala = np.nansum(np.abs(valores), axis=0).max()
+    for janela in janelas:
+        ref = pd.DataFrame(valores).groupby(grupos).rolling(janela).sum().\
+              reset_index(level=0, drop=True).sort_index().to_numpy()
+
+        np.testing.assert_array_equal(np.isnan(somas[janela]), np.isnan(ref))
+        np.testing.assert_allclose(somas[janela], ref, rtol=1e-9, atol=1e-12 * escala)
+
+@pytest.mark.parametrize('fracionarios', [False, True])
+@pytest.mark.parametrize('correcoes', [False, True])
+def test_sem_residuos(fracionarios, correcoes):
+    # janelas que somam zero dão exatamente zero, e valores não negativos nunca dão somas negativas
+    valores, grupos = dados(fracionarios, correcoes)
+    somas = covid.somas_moveis_agrupadas(valores, grupos, janelas)
+
+    for janela in janelas:
+        ref = esperado(valores, grupos, janela)
+        np.testing.assert_array_equal(somas[janela][ref == 0], 0.)
+
+        soma = somas[janela][~np.isnan(somas[janela])]
+        assert not ((soma != 0) & (np.abs(soma) < 0.1)).any()
+        if not correcoes:
+            assert (soma >= 0).all()
+
+def test_unidimensional_e_grupos_nulos():
+    valores, grupos = dados(False, False)
+    grupos = np.where(grupos == 3, -1, grupos)
+
+    somas = covid.somas_moveis_agrupadas(valores[:, 0], grupos, janelas)
+    somas_2d = covid.somas_moveis_agrupadas(valores, grupos, janelas)
+
+    for janela in janelas:
+        np.testing.assert_array_equal(somas[janela], somas_2d[janela][:, 0])
+        assert np.isnan(somas[janela][grupos < 0]).all()